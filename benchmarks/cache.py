@@ -0,0 +1,126 @@
+########################################################################
+#
+# This file is part of Timetracker.
+#
+# Timetracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Timertracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Timetracker. If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+"""Compare the cost of the Storm object caches.
+
+Every cache is given the same sequences of obj_infos:
+
+  - load: a stream of distinct objects, as when iterating over a result
+    set much larger than the cache, so every add misses and evicts;
+  - hits: random objects out of a set that fits in the cache, so every
+    add moves an object that is already cached;
+  - remove: adding and then removing every object of a full cache.
+
+ListCache is the list based LRU cache Storm used before, kept here for
+reference.
+
+usage: python benchmarks/cache.py [cache size [operations]]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storm.cache import Cache, GenerationalCache
+
+class ListCache(object):
+
+    def __init__(self, size=1000):
+        self._size = size
+        self._cache = {}
+        self._order = []
+
+    def add(self, obj_info):
+        if self._size != 0:
+            if obj_info in self._cache:
+                self._order.remove(obj_info)
+            else:
+                self._cache[obj_info] = obj_info.get_obj()
+            self._order.insert(0, obj_info)
+            if len(self._cache) > self._size:
+                del self._cache[self._order.pop()]
+
+    def remove(self, obj_info):
+        if obj_info in self._cache:
+            self._order.remove(obj_info)
+            del self._cache[obj_info]
+            return True
+        return False
+
+class FakeObjInfo(object):
+
+    def get_obj(self):
+        return self
+
+CACHES = [("ListCache", ListCache), ("Cache", Cache),
+          ("GenerationalCache", GenerationalCache)]
+
+def load(cache, infos, size, count):
+    add = cache.add
+    for obj_info in infos[:count]:
+        add(obj_info)
+
+def hits(cache, infos, size, count):
+    hot = infos[:size]
+    random.seed(0)
+    order = [random.choice(hot) for i in range(count)]
+    add = cache.add
+    for obj_info in hot:
+        add(obj_info)
+    start = time.time()
+    for obj_info in order:
+        add(obj_info)
+    return time.time() - start
+
+def remove(cache, infos, size, count):
+    add = cache.add
+    remove = cache.remove
+    for i in range(0, count, size):
+        batch = infos[i:i + size]
+        for obj_info in batch:
+            add(obj_info)
+        for obj_info in batch:
+            remove(obj_info)
+
+WORKLOADS = [("load", load), ("hits", hits), ("remove", remove)]
+
+def main():
+    size = 1000
+    count = 100000
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+    infos = [FakeObjInfo() for i in range(max(size, count))]
+    print "%u operations, cache size %u" % (count, size)
+    print "%-18s" % "" + "".join("%10s" % name for (name, w) in WORKLOADS)
+    for (name, cache_class) in CACHES:
+        timings = []
+        for (workload_name, workload) in WORKLOADS:
+            cache = cache_class(size)
+            start = time.time()
+            elapsed = workload(cache, infos, size, count)
+            if elapsed is None:
+                elapsed = time.time() - start
+            timings.append(elapsed)
+        print "%-18s" % name + "".join("%9.3fs" % t for t in timings)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+########################################################################
+#
+# This file is part of Timetracker.
+#
+# Timetracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Timertracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Timetracker. If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+"""Measure Store.flush() with many dirty objects ordered by references.
+
+The objects form chains in which every object references the one added
+after it, so the order they can be flushed in is the opposite of the
+order they got dirty in, and the scheduler has to look past all the
+objects still waiting for their references to find the next one to flush.
+
+usage: python benchmarks/flush_order.py [objects [chain length]]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storm.locals import Store, create_database, Int, Reference
+
+class Node(object):
+    __storm_table__ = "node"
+    id = Int(primary=True)
+    parent_id = Int()
+    parent = Reference(parent_id, id)
+
+def main():
+    count = 100000
+    chain_length = 1000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        chain_length = int(sys.argv[2])
+    store = Store(create_database("sqlite:"))
+    store.execute("CREATE TABLE node (id INTEGER PRIMARY KEY, "
+                  "parent_id INTEGER)")
+    chains = []
+    for i in range(0, count, chain_length):
+        chain = [Node() for j in range(min(chain_length, count - i))]
+        for node in chain:
+            store.add(node)
+        for (node, parent) in zip(chain, chain[1:]):
+            node.parent = parent
+        chains.append(chain)
+    start = time.time()
+    store.flush()
+    print "flushed %u objects in chains of %u in %.2fs" % (
+        count, chain_length, time.time() - start)
+    for chain in chains:
+        for (node, parent) in zip(chain, chain[1:]):
+            assert node.parent_id == parent.id
+
+if __name__ == "__main__":
+    main()
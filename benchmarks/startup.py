@@ -0,0 +1,80 @@
+########################################################################
+#
+# This file is part of Timetracker.
+#
+# Timetracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Timertracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Timetracker. If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+"""Measure the cold start time of timetracker.py.
+
+Every sample starts a new interpreter, which imports timetracker and runs
+a quick command against a small debug database, so the numbers include
+the interpreter startup and all the module imports.
+
+usage: python benchmarks/startup.py [runs]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import compileall
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "timetracker.py")
+
+CASES = [
+    ("python -c pass", ["-c", "pass"]),
+    ("import timetracker", ["-c", "import sys; sys.path.insert(0, %r); "
+                            "import timetracker" % ROOT]),
+    ("timetracker.py --help", [SCRIPT, "--help"]),
+    ("timetracker.py -d log", [SCRIPT, "-d", "log"]),
+    ("timetracker.py -d report", [SCRIPT, "-d", "report"]),
+    ]
+
+def measure(args, cwd, runs):
+    samples = []
+    devnull = open(os.devnull, "w")
+    try:
+        for i in range(runs):
+            start = time.time()
+            subprocess.check_call([sys.executable] + args, cwd=cwd,
+                                  stdout=devnull)
+            samples.append(time.time() - start)
+    finally:
+        devnull.close()
+    samples.sort()
+    return (samples[0], samples[len(samples) // 2])
+
+def main():
+    runs = 20
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    cwd = tempfile.mkdtemp()
+    try:
+        # Create the debug database and compile the modules (even when
+        # PYTHONDONTWRITEBYTECODE is set), so neither is part of the
+        # measurements.
+        compileall.compile_dir(ROOT, quiet=True)
+        subprocess.check_call([sys.executable, SCRIPT, "-d", "log"], cwd=cwd)
+        print "%-26s %9s %9s" % ("", "min [ms]", "median [ms]")
+        for (name, args) in CASES:
+            (fastest, median) = measure(args, cwd, runs)
+            print "%-26s %9.1f %9.1f" % (name, fastest * 1000, median * 1000)
+    finally:
+        shutil.rmtree(cwd)
+
+if __name__ == "__main__":
+    main()
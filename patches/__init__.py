@@ -0,0 +1,25 @@
+# -*- coding: latin-1 -*-
+########################################################################
+#
+# This file is part of Timetracker.
+#
+# Timetracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Timertracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Timetracker. If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+"""Database patches of the timelog schema, applied by Timelog.init().
+
+Patch 1 brings databases created before the schema was versioned up to the
+layout of the first version, patch 2 converts the timelog timestamps to integers
+and patch 3 empties the daily_totals rollup to have it rebuilt, patch 4
+recreates it in microseconds instead of seconds."""
@@ -0,0 +1,33 @@
+# -*- coding: latin-1 -*-
+########################################################################
+#
+# This file is part of Timetracker.
+#
+# Timetracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Timertracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Timetracker. If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+def apply(store):
+    """Add the tables and indexes missing in unversioned databases."""
+    store.execute("CREATE TABLE IF NOT EXISTS activities "
+                  "(id INTEGER PRIMARY KEY, name TEXT, is_work INT)")
+    store.execute("CREATE TABLE IF NOT EXISTS timelog "
+                  "(id INTEGER PRIMARY KEY, activity_id INTEGER, ts TEXT, "
+                  "details TEXT)")
+    store.execute("CREATE TABLE IF NOT EXISTS daily_totals "
+                  "(day TEXT, activity_id INTEGER, seconds INTEGER, "
+                  "PRIMARY KEY (day, activity_id))")
+    store.execute("CREATE INDEX IF NOT EXISTS timelog_ts ON timelog (ts)")
+    store.execute("CREATE INDEX IF NOT EXISTS timelog_activity_id "
+                  "ON timelog (activity_id)")
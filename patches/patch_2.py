@@ -0,0 +1,37 @@
+# -*- coding: latin-1 -*-
+########################################################################
+#
+# This file is part of Timetracker.
+#
+# Timetracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Timertracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Timetracker. If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+def apply(store):
+    """Store timelog.ts as integer microseconds since the epoch instead of
+    text, so that timestamps are compared as integers by SQLite and loaded
+    without string parsing."""
+    store.execute("CREATE TABLE timelog_epoch "
+                  "(id INTEGER PRIMARY KEY, activity_id INTEGER, ts INTEGER, "
+                  "details TEXT)")
+    # The text timestamps have the form 'YYYY-MM-DD HH:MM:SS[.ffffff]'.
+    store.execute("INSERT INTO timelog_epoch (id, activity_id, ts, details) "
+                  "SELECT id, activity_id, "
+                  "CAST(strftime('%s', ts) AS INTEGER) * 1000000 + "
+                  "CAST(substr(ts || '.000000', 21, 6) AS INTEGER), "
+                  "details FROM timelog")
+    store.execute("DROP TABLE timelog")
+    store.execute("ALTER TABLE timelog_epoch RENAME TO timelog")
+    store.execute("CREATE INDEX timelog_ts ON timelog (ts)")
+    store.execute("CREATE INDEX timelog_activity_id ON timelog (activity_id)")
@@ -0,0 +1,24 @@
+# -*- coding: latin-1 -*-
+########################################################################
+#
+# This file is part of Timetracker.
+#
+# Timetracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Timertracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Timetracker. If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+def apply(store):
+    """Empty the daily_totals rollup, whose intervals were truncated to whole
+    seconds, so that Timelog.init() rebuilds it with rounded intervals."""
+    store.execute("DELETE FROM daily_totals")
@@ -0,0 +1,29 @@
+# -*- coding: latin-1 -*-
+########################################################################
+#
+# This file is part of Timetracker.
+#
+# Timetracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Timertracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Timetracker. If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+def apply(store):
+    """Recreate the daily_totals rollup with the number of microseconds
+    instead of seconds spent on each activity, since rounding every interval
+    to whole seconds doesn't add up. Timelog.init() rebuilds the empty
+    rollup."""
+    store.execute("DROP TABLE daily_totals")
+    store.execute("CREATE TABLE daily_totals "
+                  "(day TEXT, activity_id INTEGER, microseconds INTEGER, "
+                  "PRIMARY KEY (day, activity_id))")
@@ -1,4 +1,7 @@
 import itertools
+from sys import getsizeof
+
+from storm import Undef
 
 
 class Cache(object):
@@ -8,17 +11,30 @@ class Cache(object):
     even if the user isn't holding any strong references to it.  It does
     that by holding strong references to the objects referenced by the
     last C{N} C{obj_info}s added to it (where C{N} is the cache size).
+
+    Entries are kept in a dict of links of a circular doubly linked list,
+    ordered from the most to the least recently added one, so adding,
+    removing and evicting an entry all take constant time.
+
+    @ivar evictions: Number of entries dropped to respect the size.
     """
 
     def __init__(self, size=1000):
         self._size = size
-        self._cache = {} # {obj_info: obj, ...}
-        self._order = [] # [obj_info, ...]
+        self.evictions = 0
+        self._cache = {} # {obj_info: [prev, next, obj_info, obj], ...}
+        self._root = root = []
+        root[:] = [root, root, None, None]
 
     def clear(self):
         """Clear the entire cache at once."""
+        # Break the reference cycles between the links, so the cached
+        # objects are freed right away rather than by the garbage collector.
+        for link in self._cache.itervalues():
+            del link[:]
         self._cache.clear()
-        del self._order[:]
+        root = self._root
+        root[:] = [root, root, None, None]
 
     def add(self, obj_info):
         """Add C{obj_info} as the most recent entry in the cache.
@@ -28,24 +44,44 @@ class Cache(object):
         (IOW, will be the last to leave).
         """
         if self._size != 0:
-            if obj_info in self._cache:
-                self._order.remove(obj_info)
-            else:
-                self._cache[obj_info] = obj_info.get_obj()
-            self._order.insert(0, obj_info)
-            if len(self._cache) > self._size:
-                del self._cache[self._order.pop()]
+            root = self._root
+            first = root[1]
+            link = self._cache.get(obj_info)
+            if link is None:
+                link = [root, first, obj_info, obj_info.get_obj()]
+                self._cache[obj_info] = first[0] = root[1] = link
+                if len(self._cache) > self._size:
+                    self._evict()
+            elif link is not first:
+                link_prev, link_next = link[0], link[1]
+                link_prev[1] = link_next
+                link_next[0] = link_prev
+                link[0] = root
+                link[1] = first
+                first[0] = root[1] = link
+
+    def _evict(self):
+        """Drop the least recently added entry."""
+        root = self._root
+        link = root[0]
+        link_prev = link[0]
+        link_prev[1] = root
+        root[0] = link_prev
+        del self._cache[link[2]]
+        self.evictions += 1
 
     def remove(self, obj_info):
         """Remove C{obj_info} from the cache, if present.
 
         @return: True if C{obj_info} was cached, False otherwise.
         """
-        if obj_info in self._cache:
-            self._order.remove(obj_info)
-            del self._cache[obj_info]
-            return True
-        return False
+        link = self._cache.pop(obj_info, None)
+        if link is None:
+            return False
+        link_prev, link_next = link[0], link[1]
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+        return True
 
     def set_size(self, size):
         """Set the maximum number of objects that may be held in this cache.
@@ -58,7 +94,7 @@ class Cache(object):
         else:
             # Remove all entries above the new size.
             while len(self._cache) > size:
-                del self._cache[self._order.pop()]
+                self._evict()
         self._size = size
 
     def get_cached(self):
@@ -66,7 +102,124 @@ class Cache(object):
 
         The most recently added objects come first in the list.
         """
-        return list(self._order)
+        root = self._root
+        cached = []
+        link = root[1]
+        while link is not root:
+            cached.append(link[2])
+            link = link[1]
+        return cached
+
+
+def estimate_size(obj_info):
+    """Estimate the number of bytes held by the values of C{obj_info}.
+
+    This adds up the sizes of the current values of all variables and,
+    for variables that keep an encoded copy of their value to detect
+    changes (pickled and JSON values, lists), the size of that copy.
+    Containers are measured shallowly, so the encoded copy is what
+    accounts for their contents.
+    """
+    size = getsizeof(obj_info)
+    for variable in obj_info.variables.itervalues():
+        value = variable._value
+        if value is not Undef:
+            size += getsizeof(value)
+        state = variable._checkpoint_state
+        if state is not Undef and state[1] is not value:
+            size += getsizeof(state[1])
+    return size
+
+
+class SizedCache(Cache):
+    """LRU cache bounded by the estimated memory held by its objects.
+
+    This works like L{Cache}, but the size limit is a budget in bytes,
+    checked against the L{estimate_size} of the cached C{obj_info}s, so
+    a few objects with large values can't make the cache grow without
+    bounds.  The estimate of an entry is refreshed every time it is
+    added again.
+
+    @ivar hits: Number of additions of C{obj_info}s that were already
+        cached.
+    @ivar misses: Number of additions of C{obj_info}s that were not.
+    @ivar evictions: Number of entries dropped to respect the budget.
+    @ivar resident_bytes: Estimated size of all the cached entries.
+    """
+
+    def __init__(self, size=16*1024*1024):
+        """Create a cache holding up to C{size} estimated bytes."""
+        super(SizedCache, self).__init__(size)
+        self.hits = 0
+        self.misses = 0
+        self.resident_bytes = 0
+
+    def clear(self):
+        """See L{Cache.clear}."""
+        super(SizedCache, self).clear()
+        self.resident_bytes = 0
+
+    def add(self, obj_info):
+        """See L{Cache.add}."""
+        if self._size != 0:
+            root = self._root
+            first = root[1]
+            size = estimate_size(obj_info)
+            link = self._cache.get(obj_info)
+            if link is None:
+                self.misses += 1
+                link = [root, first, obj_info, obj_info.get_obj(), size]
+                self._cache[obj_info] = first[0] = root[1] = link
+                self.resident_bytes += size
+            else:
+                self.hits += 1
+                self.resident_bytes += size - link[4]
+                link[4] = size
+                if link is not first:
+                    link_prev, link_next = link[0], link[1]
+                    link_prev[1] = link_next
+                    link_next[0] = link_prev
+                    link[0] = root
+                    link[1] = first
+                    first[0] = root[1] = link
+            # The most recent entry is kept even if it alone exceeds
+            # the budget.
+            while self.resident_bytes > self._size and root[0] is not link:
+                self._evict()
+
+    def _evict(self):
+        """See L{Cache._evict}."""
+        self.resident_bytes -= self._root[0][4]
+        super(SizedCache, self)._evict()
+
+    def remove(self, obj_info):
+        """See L{Cache.remove}."""
+        link = self._cache.get(obj_info)
+        if link is None:
+            return False
+        self.resident_bytes -= link[4]
+        return super(SizedCache, self).remove(obj_info)
+
+    def set_size(self, size):
+        """Set the budget of this cache, in estimated bytes.
+
+        If the budget is reduced, older C{obj_info}s may be dropped from
+        the cache to respect it.
+        """
+        if size == 0:
+            self.clear()
+        else:
+            root = self._root
+            while self.resident_bytes > size and root[0] is not root[1]:
+                self._evict()
+        self._size = size
+
+    def get_hit_rate(self):
+        """Return the fraction of additions that found the entry cached."""
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
 
 
 class GenerationalCache(object):
@@ -97,6 +250,7 @@ class GenerationalCache(object):
         self._size = size
         self._new_cache = {}
         self._old_cache = {}
+        self.evictions = 0
 
     def clear(self):
         """See `storm.store.Cache.clear`.
@@ -117,6 +271,10 @@ class GenerationalCache(object):
         would not be an appropriate way of treating older generations
         of actual people.
         """
+        new_cache = self._new_cache
+        for obj_info in self._old_cache:
+            if obj_info not in new_cache:
+                self.evictions += 1
         self._old_cache, self._new_cache = self._new_cache, self._old_cache
         self._new_cache.clear()
 
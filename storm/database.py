@@ -25,7 +25,7 @@ This is the common code for database support; specific databases are
 supported in modules in L{storm.databases}.
 """
 
-from storm.expr import Expr, State, compile
+from storm.expr import Expr, StatementCache, compile
 # Circular import: imported at the end of the module.
 # from storm.tracer import trace
 from storm.variables import Variable
@@ -141,6 +141,18 @@ class Result(object):
         """
         raise NotImplementedError
 
+    def get_insert_identities(self, primary_columns, count):
+        """Get a query which will return the rows just inserted by a
+        multi-row insert of C{count} rows, and the expression ordering them
+        as they were inserted.
+
+        This must be overridden in database-specific subclasses whose
+        connection sets L{Connection.batch_insert_identities}.
+
+        @rtype: (L{storm.expr.Expr}, L{storm.expr.Expr})
+        """
+        raise NotImplementedError
+
     @staticmethod
     def set_variable(variable, value):
         """Set the given variable's value from the database."""
@@ -169,12 +181,23 @@ class Connection(object):
     @cvar param_mark: The dbapi paramstyle that the database backend expects.
     @type compile: L{storm.expr.Compile}
     @cvar compile: The compiler to use for connections of this type.
+    @type statement_cache: L{storm.expr.StatementCache}
+    @ivar statement_cache: The cache of statements compiled by L{execute}.
     """
 
     result_factory = Result
     param_mark = "?"
     compile = compile
 
+    # The largest number of parameters a single statement may have, or
+    # None if the backend doesn't limit it.
+    max_parameters = None
+    # Whether the results of multi-row inserts can tell which rows were
+    # inserted, see L{Result.get_insert_identities}.
+    batch_insert_identities = False
+    # The number of compiled statements kept by L{statement_cache}.
+    statement_cache_size = 100
+
     _blocked = False
     _closed = False
     _state = STATE_CONNECTED
@@ -183,6 +206,8 @@ class Connection(object):
         self._database = database # Ensures deallocation order.
         self._event = event
         self._raw_connection = self._database.raw_connect()
+        self.statement_cache = StatementCache(self.compile,
+                                              self.statement_cache_size)
 
     def __del__(self):
         """Close the connection."""
@@ -231,9 +256,7 @@ class Connection(object):
         if isinstance(statement, Expr):
             if params is not None:
                 raise ValueError("Can't pass parameters with expressions")
-            state = State()
-            statement = self.compile(statement, state)
-            params = state.parameters
+            statement, params = self.statement_cache.compile(statement)
         statement = convert_param_marks(statement, "?", self.param_mark)
         raw_cursor = self.raw_execute(statement, params)
         if noresult:
@@ -241,6 +264,32 @@ class Connection(object):
             return None
         return self.result_factory(self, raw_cursor)
 
+    def executemany(self, statement, params):
+        """Execute a statement once for each of the given parameter lists.
+
+        This runs a statement many times with a single round trip to the
+        database, where the backend supports it.
+
+        @type statement: C{str}
+        @param statement: The statement to execute, compiled already.
+        @param params: A sequence of sequences of parameters.
+
+        @raise ConnectionBlockedError: Raised if access to the connection
+            has been blocked with L{block_access}.
+        @raise DisconnectionError: Raised when the connection is lost.
+            Reconnection happens automatically on rollback.
+        """
+        if self._closed:
+            raise ClosedError("Connection is closed")
+        if self._blocked:
+            raise ConnectionBlockedError("Access to connection is blocked")
+        if self._event:
+            self._event.emit("register-transaction")
+        self._ensure_connected()
+        statement = convert_param_marks(statement, "?", self.param_mark)
+        raw_cursor = self.raw_executemany(statement, params)
+        self._check_disconnect(raw_cursor.close)
+
     def close(self):
         """Close the connection if it is not already closed."""
         if not self._closed:
@@ -331,6 +380,32 @@ class Connection(object):
                 statement, params or ())
         return raw_cursor
 
+    def raw_executemany(self, statement, params):
+        """Execute a raw statement once for each of the given parameter lists.
+
+        It's acceptable to override this method in subclasses, but it
+        is not intended to be called externally.
+
+        Tracers expect the parameters of a single execution, so while any
+        is installed the statement is run once per parameter list with
+        L{raw_execute} instead.
+
+        @return: The dbapi cursor object, as fetched from L{build_raw_cursor}.
+        """
+        if get_tracers():
+            raw_cursor = None
+            for row in params:
+                if raw_cursor is not None:
+                    self._check_disconnect(raw_cursor.close)
+                raw_cursor = Connection.raw_execute(self, statement, row)
+            if raw_cursor is None:
+                raw_cursor = self._check_disconnect(self.build_raw_cursor)
+            return raw_cursor
+        raw_cursor = self._check_disconnect(self.build_raw_cursor)
+        args = (statement, [tuple(self.to_database(row)) for row in params])
+        self._check_disconnect(raw_cursor.executemany, *args)
+        return raw_cursor
+
     def _ensure_connected(self):
         """Ensure that we are connected to the database.
 
@@ -465,4 +540,4 @@ def create_database(uri):
     return factory(uri)
 
 # Deal with circular import.        
-from storm.tracer import trace
+from storm.tracer import trace, get_tracers
@@ -20,6 +20,9 @@
 #
 from datetime import datetime, date, time, timedelta
 from distutils.version import LooseVersion
+from collections import OrderedDict
+from itertools import count
+import re
 
 from storm.databases import dummy
 
@@ -47,7 +50,7 @@ from storm.variables import Variable, ListVariable
 from storm.database import Database, Connection, Result
 from storm.exceptions import (
     install_exceptions, DatabaseError, DatabaseModuleError, InterfaceError,
-    OperationalError, ProgrammingError, TimeoutError)
+    OperationalError, ProgrammingError, TimeoutError, DisconnectionError)
 from storm.tracer import TimeoutTracer
 
 
@@ -217,12 +220,24 @@ class PostgresResult(Result):
         return And(*equals)
 
 
+# Statements that may be prepared, and the parameter marks in them.
+_preparable = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE)\b", re.I)
+_param_mark = re.compile(r"%s")
+
+
 class PostgresConnection(Connection):
 
     result_factory = PostgresResult
     param_mark = "%s"
     compile = compile
 
+    # Statements prepared on the current raw connection, by their text,
+    # with the name they were prepared with, or None for those that
+    # couldn't be prepared.  Least recently used statements come first.
+    _prepared = None
+    _prepared_connection = None
+    _prepared_count = 0
+
     def execute(self, statement, params=None, noresult=False):
         """Execute a statement with the given parameters.
 
@@ -256,8 +271,85 @@ class PostgresConnection(Connection):
         if type(statement) is unicode:
             # psycopg breaks with unicode statements.
             statement = statement.encode("UTF-8")
+        if self._database._prepared_statements:
+            statement = self._get_prepared(statement, params)
         return Connection.raw_execute(self, statement, params)
 
+    def _get_prepared(self, statement, params):
+        """Return the statement to run C{statement} as a prepared one.
+
+        Statements are prepared with PREPARE the second time they're
+        run on a connection, and run with EXECUTE from then on, so the
+        server parses and plans them only once.  Up to the number of
+        statements given by the C{statements} URI option are kept
+        prepared, and the least recently used ones are deallocated.
+        """
+        prepared = self._prepared
+        if prepared is None or self._prepared_connection is not \
+               self._raw_connection:
+            # Prepared statements are gone along with the connection.
+            self._prepared = prepared = OrderedDict()
+            self._prepared_connection = self._raw_connection
+            self._prepare_uses = {}
+        if statement in prepared:
+            name = prepared.pop(statement)
+        else:
+            if not _preparable.match(statement) or "%%" in statement:
+                return statement
+            uses = self._prepare_uses
+            if uses.pop(statement, None) is None:
+                if len(uses) >= self._database._prepared_statements * 10:
+                    uses.clear()
+                uses[statement] = True
+                return statement
+            name = self._prepare(statement)
+        prepared[statement] = name
+        if len(prepared) > self._database._prepared_statements:
+            old_name = prepared.popitem(last=False)[1]
+            if old_name is not None:
+                Connection.raw_execute(
+                    self, "DEALLOCATE %s" % old_name).close()
+        if name is None:
+            return statement
+        if params:
+            return "EXECUTE %s(%s)" % (name, ", ".join(["%s"] * len(params)))
+        return "EXECUTE %s" % name
+
+    def _prepare(self, statement):
+        """Prepare C{statement}, returning its name or None on failure.
+
+        Failing to prepare a statement, for instance because the types
+        of its parameters can't be inferred, doesn't make the statement
+        fail, as it's simply run unprepared.  The failure is confined to
+        a savepoint, so it doesn't abort the transaction.
+        """
+        self._prepared_count += 1
+        name = "storm_%d" % self._prepared_count
+        # Parameters are numbered in PREPARE, except in string literals.
+        positions = count(1)
+        tokens = statement.split("'")
+        for i in range(0, len(tokens), 2):
+            tokens[i] = _param_mark.sub(lambda match: "$%d" % positions.next(),
+                                        tokens[i])
+        savepoint = (self._database._isolation !=
+                     psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        if savepoint:
+            Connection.raw_execute(self, "SAVEPOINT storm_prepare").close()
+        try:
+            Connection.raw_execute(
+                self, "PREPARE %s AS %s" % (name, "'".join(tokens))).close()
+        except DisconnectionError:
+            raise
+        except DatabaseError:
+            if savepoint:
+                Connection.raw_execute(
+                    self, "ROLLBACK TO SAVEPOINT storm_prepare").close()
+            return None
+        if savepoint:
+            Connection.raw_execute(
+                self, "RELEASE SAVEPOINT storm_prepare").close()
+        return name
+
     def to_database(self, params):
         """
         Like L{Connection.to_database}, but this converts datetime
@@ -324,6 +416,11 @@ class Postgres(Database):
                 "Unknown serialization level %r: expected one of "
                 "'autocommit', 'serializable', 'read-committed'" %
                 (isolation,))
+        # With statements=N, statements run more than once on a connection
+        # are prepared, and up to N of them are kept prepared.  This is off
+        # by default, as prepared statements don't work through poolers
+        # that share server connections between clients.
+        self._prepared_statements = int(uri.options.get("statements", 0))
 
     def raw_connect(self):
         raw_connection = psycopg2.connect(self._dsn)
@@ -21,6 +21,9 @@
 from datetime import datetime, date, time, timedelta
 from time import sleep, time as now
 import sys
+import re
+import random
+import threading
 
 from storm.databases import dummy
 
@@ -75,6 +78,13 @@ class SQLiteResult(Result):
     def get_insert_identity(self, primary_key, primary_variables):
         return SQLRaw("(OID=%d)" % self._raw_cursor.lastrowid)
 
+    def get_insert_identities(self, primary_key, count):
+        # The rows of a single INSERT get consecutive rowids, unless the
+        # largest rowid is in use; the caller checks the number of rows.
+        last = self._raw_cursor.lastrowid
+        return (SQLRaw("(OID BETWEEN %d AND %d)" % (last - count + 1, last)),
+                SQLRaw("OID"))
+
     @staticmethod
     def set_variable(variable, value):
         if isinstance(variable, RawStrVariable):
@@ -100,7 +110,11 @@ class SQLiteConnection(Connection):
 
     result_factory = SQLiteResult
     compile = compile
+    # SQLITE_MAX_VARIABLE_NUMBER of SQLite versions before 3.32.0.
+    max_parameters = 999
+    batch_insert_identities = True
     _in_transaction = False
+    _reader = None
 
     @staticmethod
     def to_database(params):
@@ -130,42 +144,151 @@ class SQLiteConnection(Connection):
         if self._in_transaction:
             self.raw_execute("ROLLBACK", _end=True)
 
+    def close(self):
+        if self._reader is not None:
+            self._database._release_reader(self._reader)
+            self._reader = None
+        Connection.close(self)
+
     def raw_execute(self, statement, params=None, _end=False):
         """Execute a raw statement with the given parameters.
 
         This method will automatically retry on locked database errors.
         This should be done by pysqlite, but it doesn't work with
-        versions < 2.3.4, so we make sure the timeout is respected
-        here.
+        versions < 2.3.4, and SQLite itself gives up immediately instead
+        of calling the busy handler when waiting could deadlock, so we
+        make sure the timeout is respected here.
+
+        Read-only connections don't start transactions at all.  If the
+        database has readers, SELECTs outside of transactions are run by
+        a read-only connection taken from its pool, so a connection only
+        begins a transaction (and with begin=immediate or exclusive takes
+        the database lock) once it writes.
         """
+        if self._database._read_only:
+            return self._retry_locked(Connection.raw_execute, self,
+                                      statement, params)
+        if (self._database._reader_database is not None and
+            not self._in_transaction and not _end and
+            statement.lstrip()[:6].upper() == "SELECT"):
+            if self._reader is None:
+                self._reader = self._database._acquire_reader()
+            return self._reader.raw_execute(statement, params)
         if _end:
             self._in_transaction = False
         elif not self._in_transaction:
             # See story at the end to understand why we do BEGIN manually.
+            self._retry_locked(self._raw_connection.execute,
+                               self._database._begin)
             self._in_transaction = True
-            self._raw_connection.execute("BEGIN")
-
+        try:
+            return self._retry_locked(Connection.raw_execute, self,
+                                      statement, params)
+        except sqlite.OperationalError, e:
+            if _end and str(e) == "database is locked":
+                # The operation failed due to being unable to get a
+                # lock on the database.  In this case, we are still
+                # in a transaction.
+                self._in_transaction = True
+            raise
+
+    def raw_executemany(self, statement, params):
+        """Execute a raw statement once for each of the given parameter
+        lists, in a transaction like L{raw_execute}.
+
+        Only the first parameter list is retried while the database is
+        locked: once it ran, retrying the batch would run its rows again,
+        and statements like C{SET n = n + ?} aren't idempotent.  Having
+        written, the transaction holds the lock for the remaining rows.
+        """
+        if not self._in_transaction and not self._database._read_only:
+            self._retry_locked(self._raw_connection.execute,
+                               self._database._begin)
+            self._in_transaction = True
+        params = list(params)
+        raw_cursor = self._retry_locked(Connection.raw_executemany, self,
+                                        statement, params[:1])
+        if len(params) > 1:
+            self._check_disconnect(raw_cursor.close)
+            raw_cursor = Connection.raw_executemany(self, statement,
+                                                    params[1:])
+        return raw_cursor
+
+    def _retry_locked(self, function, *args):
+        """Call function with args, retrying while the database is locked.
+
+        The pause between the attempts starts at L{BUSY_RETRY_MIN} seconds
+        and doubles up to L{BUSY_RETRY_MAX}, with half of it randomized so
+        that competing connections don't retry in lockstep.  The database
+        is considered busy for good once its timeout expired.  The waits
+        are accounted in the C{contention} counters of the database.
+        """
+        count = self._database._count_contention
         # Remember the time at which we started the operation.  If pysqlite
         # handles the timeout correctly, we won't retry the operation, because
-        # the timeout will have expired when the raw_execute() returns.
+        # the timeout will have expired when the first attempt fails.
         started = now()
+        locked = False
+        delay = BUSY_RETRY_MIN
         while True:
             try:
-                return Connection.raw_execute(self, statement, params)
+                result = function(*args)
             except sqlite.OperationalError, e:
                 if str(e) != "database is locked":
                     raise
-                elif now() - started < self._database._timeout:
-                    # pysqlite didn't handle the timeout correctly,
-                    # so we sleep a little and then retry.
-                    sleep(0.1)
-                else:
-                    # The operation failed due to being unable to get a
-                    # lock on the database.  In this case, we are still
-                    # in a transaction.
-                    if _end:
-                        self._in_transaction = True
+                if not locked:
+                    locked = True
+                    count("locked")
+                remaining = self._database._timeout - (now() - started)
+                if remaining <= 0:
+                    count("timeouts")
+                    count("waited", now() - started)
                     raise
+                count("retries")
+                sleep(min(delay / 2 + random.uniform(0, delay / 2),
+                          remaining))
+                delay = min(delay * 2, BUSY_RETRY_MAX)
+            else:
+                if locked:
+                    count("waited", now() - started)
+                return result
+
+
+# The PRAGMAs which may be given as URI options, in the order they're set
+# on new connections.  journal_mode comes first, since it decides what
+# some of the others mean.
+PRAGMA_OPTIONS = ["journal_mode", "synchronous", "cache_size", "mmap_size",
+                  "temp_store", "busy_timeout", "foreign_keys"]
+
+# PRAGMA presets, selected with the "profile" URI option.  PRAGMAs given
+# as options of their own override the ones of the profile.
+PRAGMA_PROFILES = {
+    # WAL lets readers run concurrently with the writer, and with WAL
+    # synchronous=NORMAL only risks losing the last transactions on a
+    # power failure, never corrupting the database.
+    "fast": {"journal_mode": "WAL", "synchronous": "NORMAL",
+             "cache_size": "-16000", "mmap_size": "268435456",
+             "temp_store": "MEMORY"},
+    "safe": {"journal_mode": "WAL", "synchronous": "FULL",
+             "foreign_keys": "ON"},
+    }
+
+_pragma_value = re.compile(r"^-?\w+$")
+
+# The statements starting transactions for the values of the "begin" URI
+# option.  With "immediate" or "exclusive" a writer waits for the database
+# lock when its transaction starts, rather than failing with "database is
+# locked" when it first writes after having read in a deferred transaction.
+BEGIN_STATEMENTS = {
+    "deferred": "BEGIN DEFERRED",
+    "immediate": "BEGIN IMMEDIATE",
+    "exclusive": "BEGIN EXCLUSIVE",
+    }
+
+# The bounds, in seconds, of the pauses before retrying statements which
+# failed because the database is locked.
+BUSY_RETRY_MIN = 0.001
+BUSY_RETRY_MAX = 0.1
 
 
 class SQLite(Database):
@@ -177,15 +300,104 @@ class SQLite(Database):
             raise DatabaseModuleError("'pysqlite2' module not found")
         self._filename = uri.database or ":memory:"
         self._timeout = float(uri.options.get("timeout", 5))
-        self._synchronous = uri.options.get("synchronous")
+        begin = uri.options.get("begin", "deferred")
+        if begin not in BEGIN_STATEMENTS:
+            raise ValueError(
+                "Unknown transaction mode %r: expected one of %s" %
+                (begin, ", ".join(repr(name)
+                                  for name in sorted(BEGIN_STATEMENTS))))
+        self._begin = BEGIN_STATEMENTS[begin]
+        mode = uri.options.get("mode", "rw")
+        if mode not in ("rw", "ro"):
+            raise ValueError("Unknown mode %r: expected 'rw' or 'ro'" %
+                             (mode,))
+        self._read_only = (mode == "ro")
+        # With readers=N, SELECTs outside of transactions go to read-only
+        # connections to the same file, of which up to N are kept around.
+        # This needs journal_mode=WAL, set directly or by the profile.
+        # Every connection to an in-memory database is a database of its
+        # own, so they can't have readers.
+        self._readers = int(uri.options.get("readers", 0))
+        self._reader_database = None
+        self._reader_pool = []
+        # The number of prepared statements the driver keeps around for
+        # each connection, defaulting to the size of the cache of compiled
+        # statements so that every cached statement stays prepared.
+        self._statements = int(uri.options.get(
+            "statements", SQLiteConnection.statement_cache_size))
+        # How often connections found the database locked, how often they
+        # retried, how often they gave up and how many seconds they waited.
+        # Connections may be used from several threads, so the counters
+        # are only updated while holding the lock.
+        self._contention_lock = threading.Lock()
+        self.contention = {"locked": 0, "retries": 0, "timeouts": 0,
+                           "waited": 0.0}
+        profile = uri.options.get("profile")
+        if profile is None:
+            pragmas = {}
+        elif profile in PRAGMA_PROFILES:
+            pragmas = PRAGMA_PROFILES[profile].copy()
+        else:
+            raise ValueError(
+                "Unknown PRAGMA profile %r: expected one of %s" %
+                (profile, ", ".join(repr(name)
+                                    for name in sorted(PRAGMA_PROFILES))))
+        for name in PRAGMA_OPTIONS:
+            if name in uri.options:
+                pragmas[name] = uri.options[name]
+        self._pragmas = []
+        for name in PRAGMA_OPTIONS:
+            if name in pragmas:
+                if not _pragma_value.match(pragmas[name]):
+                    raise ValueError("Invalid value for PRAGMA %s: %r" %
+                                     (name, pragmas[name]))
+                self._pragmas.append((name, pragmas[name]))
+        # A reader in the middle of a SELECT holds a shared lock, which
+        # blocks the COMMIT of the writer unless the database is in WAL
+        # mode, so readers are only used with it.
+        if (self._readers and not self._read_only and
+            dict(self._pragmas).get("journal_mode", "").upper() != "WAL"):
+            raise ValueError("readers=%d needs journal_mode=WAL" %
+                             self._readers)
+        if self._readers and not self._read_only and uri.database:
+            reader_uri = uri.copy()
+            reader_uri.options["mode"] = "ro"
+            del reader_uri.options["readers"]
+            self._reader_database = SQLite(reader_uri)
+            self._reader_database.contention = self.contention
+            self._reader_database._contention_lock = self._contention_lock
+
+    def _count_contention(self, name, value=1):
+        """Add C{value} to the C{name} counter of C{contention}."""
+        with self._contention_lock:
+            self.contention[name] += value
+
+    def _acquire_reader(self):
+        """Take a read-only connection out of the pool of readers."""
+        try:
+            return self._reader_pool.pop()
+        except IndexError:
+            return self._reader_database.connect()
+
+    def _release_reader(self, reader):
+        """Put a read-only connection back into the pool of readers."""
+        if len(self._reader_pool) < self._readers:
+            self._reader_pool.append(reader)
+        else:
+            reader.close()
 
     def raw_connect(self):
         # See the story at the end to understand why we set isolation_level.
+        # Read-only connections are pooled, and may be used by another
+        # thread than the one which opened them.
         raw_connection = sqlite.connect(self._filename, timeout=self._timeout,
-                                        isolation_level=None)
-        if self._synchronous is not None:
-            raw_connection.execute("PRAGMA synchronous = %s" %
-                                   (self._synchronous,))
+                                        isolation_level=None,
+                                        check_same_thread=not self._read_only,
+                                        cached_statements=self._statements)
+        for name, value in self._pragmas:
+            raw_connection.execute("PRAGMA %s = %s" % (name, value))
+        if self._read_only:
+            raw_connection.execute("PRAGMA query_only = ON")
         return raw_connection
 
 
@@ -700,7 +700,8 @@ def compile_select(compile, select, state):
 class Insert(Expr):
     """Expression representing an insert statement.
 
-    @ivar map: Dictionary mapping columns to values.
+    @ivar map: Dictionary mapping columns to values, or a sequence of columns
+        for a bulk insert.
     @ivar table: Table where the row should be inserted.
     @ivar default_table: Table to use if no table is explicitly provided, and
         no tables may be inferred from provided columns.
@@ -710,17 +711,21 @@ class Insert(Expr):
     @ivar primary_variables: Tuple of variables with values for the primary
         key of the table where the row will be inserted.  This is a hint used
         by backends to process the insertion of rows.
+    @ivar values: Expression or sequence of tuples of values for bulk
+        insertion, in the order of the columns in C{map}.
     """
     __slots__ = ("map", "table", "default_table", "primary_columns",
-                 "primary_variables")
+                 "primary_variables", "values")
 
     def __init__(self, map, table=Undef, default_table=Undef,
-                 primary_columns=Undef, primary_variables=Undef):
+                 primary_columns=Undef, primary_variables=Undef,
+                 values=Undef):
         self.map = map
         self.table = table
         self.default_table = default_table
         self.primary_columns = primary_columns
         self.primary_variables = primary_variables
+        self.values = values
 
 @compile.when(Insert)
 def compile_insert(compile, insert, state):
@@ -729,10 +734,18 @@ def compile_insert(compile, insert, state):
     state.context = TABLE
     table = build_tables(compile, insert.table, insert.default_table, state)
     state.context = EXPR
-    values = compile(tuple(insert.map.itervalues()), state)
+    values = insert.values
+    if values is Undef:
+        values = [tuple(insert.map.itervalues())]
+    if isinstance(values, Expr):
+        compiled_values = compile(values, state)
+    else:
+        compiled_values = (
+            "VALUES (%s)" %
+            "), (".join(compile(value, state) for value in values))
     state.pop()
-    return "".join(["INSERT INTO ", table, " (", columns,
-                    ") VALUES (", values, ")"])
+    return "".join(["INSERT INTO ", table, " (", columns, ") ",
+                    compiled_values])
 
 
 class Update(Expr):
@@ -1503,6 +1516,218 @@ def compile_auto_tables(compile, expr, state):
     return statement
 
 
+# --------------------------------------------------------------------
+# Statement cache
+
+class _NotCacheable(Exception):
+    """Raised when the key of an expression can't be built."""
+
+
+# Types whose values compile to the same SQL whenever they're equal.
+_VALUE_TYPES = set([str, unicode, int, long, float, bool, Decimal, datetime,
+                    date, time, timedelta, type(None), SQLRaw, SQLToken])
+
+# Slots that cache compilation results instead of affecting them.
+_IGNORED_SLOTS = set(["compile_cache", "compile_id", "variable_factory"])
+
+
+class StatementCache(object):
+    """LRU cache of compiled statements.
+
+    Expressions are keyed on their structure: their types, the values
+    of their attributes and of the python values they hold, but not the
+    values of their variables, which is all that changes between two
+    executions of the same query.  A cached statement comes with the
+    list of positions, in the order the variables of its expression are
+    seen, that the compiled parameters came from, so the parameters of
+    another expression with the same structure are picked from its own
+    variables without compiling it again.
+
+    Expressions holding objects the key can't account for are compiled
+    every time.
+
+    Like L{storm.cache.Cache}, entries are kept in a dict of links of a
+    circular doubly linked list, ordered from the most to the least
+    recently used one.
+
+    @ivar hits: Number of statements found in the cache.
+    @ivar misses: Number of statements compiled.
+    @ivar evictions: Number of statements dropped to respect the size.
+    """
+
+    def __init__(self, compile, size=100):
+        """
+        @param compile: The L{Compile} instance to compile statements with.
+        @param size: The number of statements kept, or 0 to disable the
+            cache.
+        """
+        self._compile = compile
+        self._size = size
+        self._cache = {} # {key: [prev, next, key, statement, plan]}
+        self._root = root = []
+        root[:] = [root, root, None, None, None]
+        self._attributes = {} # {expr type: attribute names}
+        self._parameter_types = {} # {variable type: compiles as "?"}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        """Drop all the cached statements."""
+        for link in self._cache.itervalues():
+            del link[:]
+        self._cache.clear()
+        root = self._root
+        root[:] = [root, root, None, None, None]
+
+    def set_size(self, size):
+        """Set the number of statements kept in the cache."""
+        self._size = size
+        while len(self._cache) > size:
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used statement."""
+        root = self._root
+        link = root[0]
+        link_prev = link[0]
+        link_prev[1] = root
+        root[0] = link_prev
+        del self._cache[link[2]]
+        self.evictions += 1
+
+    def compile(self, expr):
+        """Compile C{expr}, using the cached statement if there's one.
+
+        @return: A tuple with the statement and its parameters.
+        """
+        key = None
+        if self._size != 0:
+            variables = []
+            try:
+                key = self._get_key(expr, variables, {})
+                link = self._cache.get(key)
+            except (_NotCacheable, TypeError):
+                # TypeError comes from values that aren't hashable.
+                key = None
+            else:
+                if link is not None:
+                    self.hits += 1
+                    root = self._root
+                    first = root[1]
+                    if link is not first:
+                        link_prev, link_next = link[0], link[1]
+                        link_prev[1] = link_next
+                        link_next[0] = link_prev
+                        link[0] = root
+                        link[1] = first
+                        first[0] = root[1] = link
+                    statement, plan = link[3], link[4]
+                    return statement, [variables[position]
+                                       if position is not None else value
+                                       for position, value in plan]
+        state = State()
+        statement = self._compile(expr, state)
+        if key is not None:
+            self.misses += 1
+            positions = dict((id(variable), position)
+                             for position, variable in enumerate(variables))
+            plan = []
+            for param in state.parameters:
+                position = positions.get(id(param))
+                if position is None:
+                    # Made by the compiler from a value in the key.
+                    plan.append((None, param))
+                else:
+                    plan.append((position, None))
+            root = self._root
+            first = root[1]
+            link = [root, first, key, statement, tuple(plan)]
+            first[0] = root[1] = link
+            self._cache[key] = link
+            if len(self._cache) > self._size:
+                self._evict()
+        return statement, state.parameters
+
+    def _get_key(self, expr, variables, positions):
+        """Build the structural key of C{expr}.
+
+        Variables are replaced by the position they were first seen in,
+        and appended to C{variables}.
+        """
+        expr_type = type(expr)
+        if expr_type in _VALUE_TYPES:
+            return (expr_type, expr)
+        if expr_type is tuple or expr_type is list:
+            return (expr_type,) + tuple([self._get_key(subexpr, variables,
+                                                       positions)
+                                         for subexpr in expr])
+        if isinstance(expr, Expr):
+            if isinstance(expr, Column):
+                # Columns are compiled from their name and table alone,
+                # and the table is most often a class.
+                table = expr.table
+                if type(table) is not type:
+                    table = self._get_key(table, variables, positions)
+                return (expr_type, expr.name, table)
+            attributes = self._attributes.get(expr_type)
+            if attributes is None:
+                attributes = self._get_attributes(expr_type)
+            key = [expr_type]
+            for name in attributes:
+                key.append(self._get_key(getattr(expr, name, Undef),
+                                         variables, positions))
+            if hasattr(expr, "__dict__"):
+                for name, value in sorted(expr.__dict__.iteritems()):
+                    key.append(name)
+                    key.append(self._get_key(value, variables, positions))
+            return tuple(key)
+        if isinstance(expr, Variable):
+            is_parameter = self._parameter_types.get(expr_type)
+            if is_parameter is None:
+                is_parameter = self._is_parameter_type(expr_type)
+            if not is_parameter:
+                raise _NotCacheable()
+            position = positions.get(id(expr))
+            if position is None:
+                position = positions[id(expr)] = len(variables)
+                variables.append(expr)
+            return (Variable, position)
+        if expr_type is dict:
+            return (dict,) + tuple([
+                (self._get_key(column, variables, positions),
+                 self._get_key(value, variables, positions))
+                for column, value in expr.iteritems()])
+        if expr is Undef or isinstance(expr, type):
+            return expr
+        raise _NotCacheable()
+
+    def _get_attributes(self, expr_type):
+        attributes = []
+        for cls in reversed(expr_type.__mro__):
+            for name in cls.__dict__.get("__slots__", ()):
+                if name not in _IGNORED_SLOTS:
+                    attributes.append(name)
+        self._attributes[expr_type] = attributes = tuple(attributes)
+        return attributes
+
+    def _is_parameter_type(self, variable_type):
+        """Tell whether variables of the given type always compile to "?".
+
+        Backends may compile some variable types depending on their value,
+        like lists, and those can't be cached.
+        """
+        dispatch_table = self._compile._dispatch_table
+        for cls in variable_type.__mro__:
+            if cls in dispatch_table:
+                is_parameter = cls is Variable
+                break
+        else:
+            is_parameter = False
+        self._parameter_types[variable_type] = is_parameter
+        return is_parameter
+
+
 # --------------------------------------------------------------------
 # Set operator precedences.
 
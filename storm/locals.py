@@ -18,14 +18,58 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
-from storm.properties import Bool, Int, Float, RawStr, Chars, Unicode
-from storm.properties import List, Decimal, DateTime, Date, Time, Enum, UUID
-from storm.properties import TimeDelta, Pickle, JSON
-from storm.references import Reference, ReferenceSet, Proxy
-from storm.database import create_database
-from storm.exceptions import StormError
-from storm.store import Store, AutoReload
-from storm.expr import Select, Insert, Update, Delete, Join, SQL
-from storm.expr import Like, In, Asc, Desc, And, Or, Min, Max, Count, Not
-from storm.info import ClassAlias
-from storm.base import Storm
+"""All the public names of Storm in one namespace.
+
+The names are imported from the module defining them on first access, so
+importing a few of them (or only this module) doesn't load all of Storm.
+C{from storm.locals import *} still imports everything.
+"""
+import sys
+from types import ModuleType
+
+
+_MODULES = {
+    "storm.properties": ["Bool", "Int", "Float", "RawStr", "Chars", "Unicode",
+                         "List", "Decimal", "DateTime", "Date", "Time", "Enum",
+                         "UUID", "EpochDateTime", "TimeDelta", "Pickle",
+                         "JSON"],
+    "storm.references": ["Reference", "ReferenceSet", "Proxy"],
+    "storm.database": ["create_database"],
+    "storm.exceptions": ["StormError"],
+    "storm.store": ["Store", "AutoReload"],
+    "storm.expr": ["Select", "Insert", "Update", "Delete", "Join", "SQL",
+                   "Like", "In", "Asc", "Desc", "And", "Or", "Min", "Max",
+                   "Count", "Not"],
+    "storm.info": ["ClassAlias"],
+    "storm.base": ["Storm"],
+    }
+
+
+class LazyLocals(ModuleType):
+    """Module type resolving the names of L{_MODULES} on first access."""
+
+    def __init__(self, module):
+        ModuleType.__init__(self, module.__name__, module.__doc__)
+        # Python 2 clears the globals of a module when it's collected,
+        # so the replaced module has to be kept alive.
+        self._module = module
+        self._origins = {}
+        for module_name, names in _MODULES.iteritems():
+            for name in names:
+                self._origins[name] = module_name
+        self.__file__ = module.__file__
+        self.__all__ = sorted(self._origins)
+
+    def __getattr__(self, name):
+        module_name = self._origins.get(name)
+        if module_name is None:
+            raise AttributeError("'module' object has no attribute %r" % name)
+        value = getattr(__import__(module_name, None, None, [name]), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self._origins))
+
+
+sys.modules[__name__] = LazyLocals(sys.modules[__name__])
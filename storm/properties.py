@@ -28,14 +28,14 @@ from storm.expr import Column, Undef
 from storm.variables import (
     Variable, VariableFactory, BoolVariable, IntVariable, FloatVariable,
     DecimalVariable, RawStrVariable, UnicodeVariable, DateTimeVariable,
-    DateVariable, TimeVariable, TimeDeltaVariable, UUIDVariable,
+    EpochDateTimeVariable, DateVariable, TimeVariable, TimeDeltaVariable, UUIDVariable,
     PickleVariable, JSONVariable, ListVariable, EnumVariable)
 
 
 
 __all__ = ["Property", "SimpleProperty",
            "Bool", "Int", "Float", "Decimal", "RawStr", "Unicode",
-           "DateTime", "Date", "Time", "TimeDelta", "UUID", "Enum",
+           "DateTime", "EpochDateTime", "Date", "Time", "TimeDelta", "UUID", "Enum",
            "Pickle", "JSON", "List", "PropertyRegistry"]
 
 
@@ -157,6 +157,11 @@ class Unicode(SimpleProperty):
 class DateTime(SimpleProperty):
     variable_class = DateTimeVariable
 
+class EpochDateTime(SimpleProperty):
+    """Datetime property stored as an integer number of seconds since the
+    epoch, or microseconds with C{microseconds=True}."""
+    variable_class = EpochDateTimeVariable
+
 class Date(SimpleProperty):
     variable_class = DateVariable
 
@@ -25,9 +25,9 @@ from storm.exceptions import (
 from storm.store import Store, get_where_for_args, LostObjectError
 from storm.variables import LazyValue
 from storm.expr import (
-    Select, Column, Exists, ComparableExpr, LeftJoin, Not, SQLRaw,
+    Select, Column, Exists, ComparableExpr, LeftJoin, Not, Or, SQLRaw,
     compare_columns, compile)
-from storm.info import get_cls_info, get_obj_info
+from storm.info import ClassAlias, get_cls_info, get_obj_info
 
 
 __all__ = ["Reference", "ReferenceSet", "Proxy"]
@@ -110,6 +110,7 @@ class Reference(object):
     # it's *NOT* part of the public API of Storm (we'll modify it without
     # warnings!).
     _relation = LazyAttribute("_relation", "_build_relation")
+    _eager_join = LazyAttribute("_eager_join", "_build_eager_join")
 
     def __init__(self, local_key, remote_key, on_remote=False):
         """
@@ -200,6 +201,72 @@ class Reference(object):
         self._relation = Relation(self._local_key, self._remote_key,
                                   False, self._on_remote)
 
+    def _build_eager_join(self):
+        """Build the join loading the remote objects along with local ones.
+
+        This is used by L{Store.find<storm.store.Store.find>} when eager
+        loading the reference.  The remote class is joined through an
+        alias of its own, so that it may also be part of the query.
+
+        The join is kept as a tuple of the alias's class info, the
+        L{LeftJoin} adding it to the query, and a function linking a local
+        object to the remote object loaded from the alias's columns.
+        """
+        relation = self._relation
+        alias = ClassAlias(relation.remote_cls)
+        cls_info = get_cls_info(relation.remote_cls)
+        alias_info = get_cls_info(alias)
+        positions = dict((id(column), i)
+                         for i, column in enumerate(cls_info.columns))
+        remote_key = [alias_info.columns[positions[id(column)]]
+                      for column in relation.remote_key]
+        join = LeftJoin(alias, compare_columns(relation.local_key, remote_key))
+        self._eager_join = (alias_info, join, self._link_eager)
+
+    def _link_eager(self, local, remote):
+        relation = self._relation
+        if relation.get_remote(local) is not remote:
+            relation.link(local, remote)
+
+    def _prefetch(self, store, locals):
+        """Load and link the remote objects of the given local objects.
+
+        This is used by L{ResultSet.prefetch<storm.store.ResultSet.prefetch>}.
+        Remote objects found by primary key are taken from memory when
+        they're alive, and all the others are fetched together.
+        """
+        relation = self._relation
+        pending = []
+        for local in locals:
+            relation_data = get_obj_info(local).get(relation)
+            if relation_data is not None:
+                remote = relation_data.get("remote")
+                if (remote is not None and
+                    not get_obj_info(remote).get("invalidated")):
+                    continue
+            if not relation.local_variables_are_none(local):
+                pending.append(local)
+        if not pending:
+            return
+        keys = _get_local_keys(relation, pending)
+        if relation.remote_key_is_primary:
+            entries = keys.values()
+            remotes = store.get_many(relation.remote_cls,
+                                     [variables for variables, locals
+                                      in entries])
+            for (variables, locals), remote in zip(entries, remotes):
+                if remote is not None:
+                    for local in locals:
+                        relation.link(local, remote)
+        else:
+            for remote in _find_by_local_keys(store, relation.remote_cls,
+                                              relation, keys):
+                entry = keys.pop(_get_key(
+                    relation.get_remote_variables(remote)), None)
+                if entry is not None:
+                    for local in entry[1]:
+                        relation.link(local, remote)
+
     def __eq__(self, other):
         return self._relation.get_where_for_local(other)
 
@@ -271,6 +338,37 @@ class ReferenceSet(object):
         else:
             self._relation2 = None
 
+    def _prefetch(self, store, locals):
+        """Load the remote objects of the given local objects.
+
+        This is used by L{ResultSet.prefetch<storm.store.ResultSet.prefetch>}.
+        The objects found for every local object are kept in its object
+        info, and iterating over its bound reference set returns them
+        for as long as the store's generation doesn't change.
+        """
+        relation1 = self._relation1
+        relation2 = self._relation2
+        keys = _get_local_keys(relation1, locals)
+        remotes = dict((key, []) for key in keys)
+        if relation2 is None:
+            for remote in _find_by_local_keys(store, relation1.remote_cls,
+                                              relation1, keys,
+                                              order_by=self._order_by):
+                key = _get_key(relation1.get_remote_variables(remote))
+                remotes[key].append(remote)
+        else:
+            cls_spec = (relation2.local_cls, relation1.remote_cls)
+            for remote, link in _find_by_local_keys(
+                store, cls_spec, relation1, keys,
+                relation2.get_where_for_join(), self._order_by):
+                key = _get_key(relation1.get_remote_variables(link))
+                remotes[key].append(remote)
+        generation = store._get_generation()
+        for key, (variables, locals) in keys.iteritems():
+            for local in locals:
+                get_obj_info(local)[(_PREFETCHED, relation1)] = (
+                    generation, remotes[key])
+
 
 class BoundReferenceSetBase(object):
 
@@ -285,6 +383,9 @@ class BoundReferenceSetBase(object):
         return result
 
     def __iter__(self):
+        remotes = _get_prefetched(self._local, self._prefetch_relation)
+        if remotes is not None:
+            return iter(remotes)
         return self.find().__iter__()
 
     def __contains__(self, item):
@@ -319,6 +420,7 @@ class BoundReferenceSet(BoundReferenceSetBase):
         self._local = local
         self._target_cls = self._relation.remote_cls
         self._order_by = order_by
+        self._prefetch_relation = relation
 
     def _get_where_clause(self):
         return self._relation.get_where_for_remote(self._local)
@@ -332,6 +434,7 @@ class BoundReferenceSet(BoundReferenceSetBase):
             raise NoStoreError("Can't perform operation without a store")
         where = self._relation.get_where_for_remote(self._local)
         store.find(self._target_cls, where, *args, **kwargs).set(**set_kwargs)
+        _drop_prefetched(self._local, self._prefetch_relation)
 
     def add(self, remote):
         self._relation.link(self._local, remote, True)
@@ -351,6 +454,7 @@ class BoundIndirectReferenceSet(BoundReferenceSetBase):
 
         self._target_cls = relation2.local_cls
         self._link_cls = relation1.remote_cls
+        self._prefetch_relation = relation1
 
     def _get_where_clause(self):
         return (self._relation1.get_where_for_remote(self._local) &
@@ -367,6 +471,7 @@ class BoundIndirectReferenceSet(BoundReferenceSetBase):
             table = get_cls_info(self._target_cls).table
             where &= Exists(Select(SQLRaw("*"), join & filter, tables=table))
         store.find(self._link_cls, where).remove()
+        _drop_prefetched(self._local, self._prefetch_relation)
 
     def add(self, remote):
         link = self._link_cls()
@@ -446,6 +551,75 @@ def compile_proxy(compile, proxy, state):
     return compile(proxy._remote_prop, state)
 
 
+# Key of the objects prefetched for a reference set in the object info
+# of the local object, along with the relation.
+_PREFETCHED = "prefetched"
+
+
+def _get_key(variables):
+    return tuple(variable.get(to_db=True) for variable in variables)
+
+
+def _get_local_keys(relation, locals):
+    """Group the given local objects by the values of their local key.
+
+    @return: A dict mapping the values to the variables of the key of the
+        first of the objects, and the list of objects.
+    """
+    keys = {}
+    for local in locals:
+        variables = relation.get_local_variables(local)
+        key = _get_key(variables)
+        if key in keys:
+            keys[key][1].append(local)
+        else:
+            keys[key] = (variables, [local])
+    return keys
+
+
+def _find_by_local_keys(store, cls_spec, relation, keys, where=None,
+                        order_by=None):
+    """Find the objects whose remote key matches one of the given keys.
+
+    Keys are looked up in batches, with one query each.
+    """
+    remote_key = relation.remote_key
+    key_variables = [variables for variables, locals in keys.itervalues()]
+    size = store._get_batch_size(len(remote_key))
+    for start in range(0, len(key_variables), size):
+        batch = key_variables[start:start + size]
+        if len(remote_key) == 1:
+            match = remote_key[0].is_in([variables[0] for variables in batch])
+        else:
+            match = Or(*[compare_columns(remote_key, variables)
+                         for variables in batch])
+        if where is not None:
+            match = match & where
+        result = store.find(cls_spec, match)
+        if order_by is not None:
+            result.order_by(order_by)
+        for item in result:
+            yield item
+
+
+def _get_prefetched(local, relation):
+    """Return the objects prefetched for a reference set, if still valid."""
+    local_info = get_obj_info(local)
+    prefetched = local_info.get((_PREFETCHED, relation))
+    if prefetched is None:
+        return None
+    generation, remotes = prefetched
+    store = Store.of(local)
+    if store is None or store._get_generation() != generation:
+        del local_info[(_PREFETCHED, relation)]
+        return None
+    return remotes
+
+
+def _drop_prefetched(local, relation):
+    get_obj_info(local).pop((_PREFETCHED, relation), None)
+
+
 class Relation(object):
 
     def __init__(self, local_key, remote_key, many, on_remote):
@@ -26,20 +26,23 @@ This module contains the highest-level ORM interface in Storm.
 
 from copy import copy
 from weakref import WeakValueDictionary
-from operator import itemgetter
+from heapq import heapify, heappop, heappush
+from itertools import islice
 
 from storm.info import get_cls_info, get_obj_info, set_obj_info
 from storm.variables import Variable, LazyValue
 from storm.expr import (
     Expr, Select, Insert, Update, Delete, Column, Count, Max, Min,
-    Avg, Sum, Eq, And, Asc, Desc, compile_python, compare_columns, SQLRaw,
-    Union, Except, Intersect, Alias, SetExpr)
+    Avg, Sum, Eq, And, Or, Asc, Desc, compile_python, compare_columns,
+    SQLRaw, Union, Except, Intersect, Alias, SetExpr, State, AutoTables)
 from storm.exceptions import (
     WrongStoreError, NotFlushedError, OrderLoopError, UnorderedError,
-    NotOneError, FeatureError, CompileError, LostObjectError, ClassInfoError)
+    NotOneError, FeatureError, CompileError, LostObjectError, ClassInfoError,
+    StoreError)
 from storm import Undef
 from storm.cache import Cache
 from storm.event import EventSystem
+from storm.tracer import trace
 
 
 __all__ = ["Store", "AutoReload", "EmptyResultSet"]
@@ -48,6 +51,13 @@ __all__ = ["Store", "AutoReload", "EmptyResultSet"]
 PENDING_ADD = 1
 PENDING_REMOVE = 2
 
+# The largest number of objects flushed with a single statement.
+BATCH_SIZE = 500
+
+# Counters kept by every store and returned by Store.stats().
+STATS = ("get_hits", "get_fetches", "load_hits", "load_builds", "rebuilds",
+         "invalidations", "autoreloads")
+
 
 class Store(object):
     """The Storm Store.
@@ -80,6 +90,9 @@ class Store(object):
             self._cache = cache
         self._implicit_flush_block_count = 0
         self._sequence = 0 # Advisory ordering.
+        # Bumped whenever objects may have changed, never reset.
+        self._generation = 0
+        self._stats = dict.fromkeys(STATS, 0)
 
     def get_database(self):
         """Return this Store's Database object."""
@@ -152,23 +165,14 @@ class Store(object):
         if self._implicit_flush_block_count == 0:
             self.flush()
 
-        if type(key) != tuple:
-            key = (key,)
-
         cls_info = get_cls_info(cls)
-
-        assert len(key) == len(cls_info.primary_key)
-
-        primary_vars = []
-        for column, variable in zip(cls_info.primary_key, key):
-            if not isinstance(variable, Variable):
-                variable = column.variable_factory(value=variable)
-            primary_vars.append(variable)
-
+        primary_vars = self._get_primary_vars(cls_info, key)
         primary_values = tuple(var.get(to_db=True) for var in primary_vars)
         obj_info = self._alive.get((cls_info.cls, primary_values))
         if obj_info is not None and not obj_info.get("invalidated"):
+            self._count("get_hits", obj_info)
             return self._get_object(obj_info)
+        self._count("get_fetches", obj_info)
 
         where = compare_columns(cls_info.primary_key, primary_vars)
 
@@ -181,6 +185,78 @@ class Store(object):
             return None
         return self._load_object(cls_info, result, values)
 
+    def get_many(self, cls, keys):
+        """Get objects of type cls with the given primary keys.
+
+        Objects which are alive are taken from memory, like with L{get},
+        and all the others are fetched from the database together, with
+        as few queries as the backend's limit on statement parameters
+        allows.
+
+        @param cls: Class of the objects to be retrieved.
+        @param keys: Sequence of primary keys.  Each may be a tuple for
+            composed keys.
+
+        @return: A list with the object found for each key, in the order
+            of C{keys}, and None for keys for which no object was found.
+        """
+        if self._implicit_flush_block_count == 0:
+            self.flush()
+
+        cls_info = get_cls_info(cls)
+        primary_key = cls_info.primary_key
+        objects = [None] * len(keys)
+        missing = {} # {primary values: (primary vars, [index, ...])}
+        for i, key in enumerate(keys):
+            primary_vars = self._get_primary_vars(cls_info, key)
+            primary_values = tuple(var.get(to_db=True) for var in primary_vars)
+            obj_info = self._alive.get((cls_info.cls, primary_values))
+            if obj_info is not None and not obj_info.get("invalidated"):
+                self._count("get_hits", obj_info)
+                objects[i] = self._get_object(obj_info)
+            elif primary_values in missing:
+                missing[primary_values][1].append(i)
+            else:
+                self._count("get_fetches", obj_info)
+                missing[primary_values] = (primary_vars, [i])
+
+        missing_vars = [primary_vars for primary_vars, indexes
+                        in missing.itervalues()]
+        size = self._get_batch_size(len(primary_key))
+        for start in range(0, len(missing_vars), size):
+            batch = missing_vars[start:start + size]
+            if len(primary_key) == 1:
+                where = primary_key[0].is_in(
+                    [primary_vars[0] for primary_vars in batch])
+            else:
+                where = Or(*[compare_columns(primary_key, primary_vars)
+                             for primary_vars in batch])
+            result = self._connection.execute(
+                Select(cls_info.columns, where,
+                       default_tables=cls_info.table))
+            for values in result:
+                obj = self._load_object(cls_info, result, values)
+                primary_values = tuple(
+                    var.get(to_db=True)
+                    for var in get_obj_info(obj)["primary_vars"])
+                for i in missing[primary_values][1]:
+                    objects[i] = obj
+        return objects
+
+    def _get_primary_vars(self, cls_info, key):
+        """Return variables with the values of a key given to L{get}."""
+        if type(key) != tuple:
+            key = (key,)
+
+        assert len(key) == len(cls_info.primary_key)
+
+        primary_vars = []
+        for column, variable in zip(cls_info.primary_key, key):
+            if not isinstance(variable, Variable):
+                variable = column.variable_factory(value=variable)
+            primary_vars.append(variable)
+        return primary_vars
+
     def find(self, cls_spec, *args, **kwargs):
         """Perform a query.
 
@@ -191,21 +267,32 @@ class Store(object):
             store.find((Company, Person), Person.company_id == Company.id) -->
                 iterator of tuples of Company and Person instances which are
                 associated via the company_id -> Company relation.
+            store.find(Person, eager=[Person.company]) --> all Persons,
+                with the Company of each loaded in the same query.
 
         @param cls_spec: The class or tuple of classes whose
             associated tables will be queried.
         @param args: Instances of L{Expr}.
         @param kwargs: Mapping of simple column names to values or
             expressions to query for.
+        @param eager: Optionally, a sequence of L{Reference} properties of
+            the classes being found.  The referenced objects are loaded
+            through a left join in the same query, and linked to the
+            found objects so that accessing the references doesn't query
+            the database again.
 
         @return: A L{ResultSet} of instances C{cls_spec}. If C{cls_spec}
             was a tuple, then an iterator of tuples of such instances.
         """
         if self._implicit_flush_block_count == 0:
             self.flush()
+        eager = kwargs.pop("eager", None)
         find_spec = FindSpec(cls_spec)
         where = get_where_for_args(args, kwargs, find_spec.default_cls)
-        return self._result_set_factory(self, find_spec, where)
+        result_set = self._result_set_factory(self, find_spec, where)
+        if eager:
+            result_set._set_eager(eager)
+        return result_set
 
     def using(self, *tables):
         """Specify tables to use explicitly.
@@ -363,16 +450,60 @@ class Store(object):
         self._alive.clear()
         self._dirty.clear()
         self._cache.clear()
+        self._generation += 1
         # The following line is untested, but then, I can't really find a way
         # to test it without whitebox.
         self._order.clear()
 
+    def stats(self):
+        """Return the counters of how objects were found by this store.
+
+        The result is a dict with the following counters, which are
+        also reported as they change to the C{store_cache_event(store,
+        name, obj_info)} method of installed tracers:
+
+          - C{get_hits}: L{get} calls answered by an object in memory.
+          - C{get_fetches}: L{get} calls that queried the database.
+          - C{load_hits}: rows loaded for objects that were in memory.
+          - C{load_builds}: rows loaded into newly built objects.
+          - C{rebuilds}: objects that had been collected by Python and
+            were built again from their cached values.
+          - C{invalidations}: objects invalidated, explicitly or on
+            transaction boundaries.
+          - C{autoreloads}: queries made to reload the values of an
+            object when they were touched.
+
+        It also has C{cache_evictions}, the number of objects the cache
+        dropped to respect its size, when the cache counts them, and
+        C{statement_hits}, C{statement_misses} and C{statement_evictions}
+        from the statement cache of the connection.
+        """
+        stats = self._stats.copy()
+        stats["cache_evictions"] = getattr(self._cache, "evictions", 0)
+        statement_cache = self._connection.statement_cache
+        stats["statement_hits"] = statement_cache.hits
+        stats["statement_misses"] = statement_cache.misses
+        stats["statement_evictions"] = statement_cache.evictions
+        return stats
+
+    def _count(self, name, obj_info):
+        self._stats[name] += 1
+        trace("store_cache_event", self, name, obj_info)
+
+    def _get_generation(self):
+        """Return a value which changes whenever an object of this store
+        gets dirty, flushed or invalidated, so results read from the
+        database can be reused for as long as it doesn't change."""
+        return self._generation
+
 
     def _mark_autoreload(self, obj=None, invalidate=False):
         if obj is None:
             obj_infos = self._iter_alive()
         else:
             obj_infos = (get_obj_info(obj),)
+        if invalidate:
+            self._generation += 1
         for obj_info in obj_infos:
             cls_info = obj_info.cls_info
             for column in cls_info.columns:
@@ -385,6 +516,7 @@ class Store(object):
                 # (e.g. by a get()), the database should be queried to see
                 # if the object's still there.
                 obj_info["invalidated"] = True
+                self._count("invalidations", obj_info)
         # We want to make sure we've marked all objects as invalidated and set
         # up their autoreloads before calling the invalidated hook on *any* of
         # them, because an invalidated hook might use other objects and we want
@@ -451,6 +583,8 @@ class Store(object):
                 flushing[obj_info] = obj
                 self._run_hook(obj_info, "__storm_pre_flush__")
         self._dirty = flushing
+        if flushing:
+            self._generation += 1
 
         predecessors = {}
         for (before_info, after_info), n in self._order.iteritems():
@@ -461,34 +595,333 @@ class Store(object):
                 else:
                     before_set.add(before_info)
 
-        key_func = itemgetter("sequence")
-
         # The external loop is important because items can get into the dirty
         # state while we're flushing objects, ...
         while self._dirty:
-            # ... but we don't have to resort everytime an object is flushed,
-            # so we have an internal loop too.  If no objects become dirty
-            # during flush, this will clean self._dirty and the external loop
-            # will exit too.
-            sorted_dirty = sorted(self._dirty, key=key_func)
-            while sorted_dirty:
-                for i, obj_info in enumerate(sorted_dirty):
-                    for before_info in predecessors.get(obj_info, ()):
-                        if before_info in self._dirty:
-                            break # A predecessor is still dirty.
-                    else:
-                        break # Found an item without dirty predecessors.
+            # ... but we don't have to schedule everything again every time
+            # an object is flushed, so we have an internal loop too.  If no
+            # objects become dirty during flush, this will clean self._dirty
+            # and the external loop will exit too.
+            #
+            # The objects are scheduled with Kahn's algorithm: an object is
+            # ready once all its predecessors are flushed, and the ready
+            # objects are flushed in the order they got dirty.
+            waiting = {}
+            successors = {}
+            ready = []
+            for obj_info in self._dirty:
+                count = 0
+                for before_info in predecessors.get(obj_info, ()):
+                    if before_info in self._dirty:
+                        count += 1
+                        successors.setdefault(before_info, []).append(obj_info)
+                if count:
+                    waiting[obj_info] = count
                 else:
-                    raise OrderLoopError("Can't flush due to ordering loop")
-                del sorted_dirty[i]
-                self._dirty.pop(obj_info, None)
-                self._flush_one(obj_info)
+                    ready.append((obj_info["sequence"], obj_info))
+            heapify(ready)
+            deferred = False
+            while ready:
+                obj_info = heappop(ready)[1]
+                if self._has_dirty_predecessor(obj_info, predecessors):
+                    # A predecessor became dirty again while flushing, so
+                    # leave this one for the next round.
+                    deferred = True
+                    continue
+                batch = [obj_info]
+                batch_key = self._get_batch_key(obj_info)
+                if batch_key is not None:
+                    size = self._get_batch_size(batch_key[1])
+                    while ready and len(batch) < size:
+                        candidate = ready[0][1]
+                        if (self._get_batch_key(candidate) != batch_key or
+                            self._has_dirty_predecessor(candidate,
+                                                        predecessors)):
+                            break
+                        heappop(ready)
+                        batch.append(candidate)
+                # Keep the objects alive until their hooks have run.
+                objs = [self._dirty.pop(obj_info, None) for obj_info in batch]
+                if len(batch) == 1:
+                    self._flush_one(obj_info)
+                else:
+                    pending = obj_info.get("pending")
+                    if pending is PENDING_ADD:
+                        self._flush_inserts(batch)
+                    elif pending is PENDING_REMOVE:
+                        self._flush_removes(batch)
+                    else:
+                        self._flush_updates(batch)
+                for flushed_info in batch:
+                    for after_info in successors.pop(flushed_info, ()):
+                        count = waiting[after_info] - 1
+                        if count:
+                            waiting[after_info] = count
+                        else:
+                            del waiting[after_info]
+                            heappush(ready,
+                                     (after_info["sequence"], after_info))
+            if waiting and not deferred:
+                raise OrderLoopError("Can't flush due to ordering loop")
 
         self._order.clear()
 
         # That's not stricly necessary, but prevents getting into bigints.
         self._sequence = 0
 
+    def _has_dirty_predecessor(self, obj_info, predecessors):
+        for before_info in predecessors.get(obj_info, ()):
+            if before_info in self._dirty:
+                return True
+        return False
+
+    def _get_batch_size(self, parameters):
+        """Return the number of objects to flush or fetch together, each
+        taking the given number of statement parameters: L{BATCH_SIZE}, or
+        as many as the backend accepts parameters for."""
+        size = BATCH_SIZE
+        max_parameters = self._connection.max_parameters
+        if max_parameters is not None:
+            size = min(size, max_parameters // parameters)
+        return max(size, 1)
+
+    def _get_batch_key(self, obj_info):
+        """Return a key telling how the given object can be flushed together
+        with others, and the number of statement parameters it takes.
+
+        Ready objects with equal keys which are next in the flush order are
+        flushed together, up to L{_get_batch_size} of them: they are
+        inserted with one multi-row insert, deleted with one delete, or
+        updated with one update or one
+        L{executemany<storm.database.Connection.executemany>} call.
+        None is returned for objects which have to be flushed on their
+        own.
+        """
+        pending = obj_info.get("pending")
+        cls_info = obj_info.cls_info
+        if pending is PENDING_REMOVE:
+            return ("remove", id(cls_info)), len(cls_info.primary_key)
+        if pending is PENDING_ADD:
+            columns = self._get_insert_columns(obj_info)
+            if columns is None:
+                return None
+            return (("add", id(cls_info), tuple(map(id, columns))),
+                    len(columns))
+        columns = self._get_update_columns(obj_info)
+        if columns is None:
+            return None
+        return (("update", id(cls_info), tuple(map(id, columns))),
+                len(columns) + len(cls_info.primary_key))
+
+    def _get_insert_columns(self, obj_info):
+        """Return the columns the insert of the given object sets.
+
+        None is returned if the object has to be inserted on its own since
+        some of its values are SQL expressions, or its primary key is set
+        by the database and the backend can't tell the keys of rows
+        inserted together.
+        """
+        cls_info = obj_info.cls_info
+        # Give a chance to the backend to process primary variables.
+        self._connection.preset_primary_key(cls_info.primary_key,
+                                            obj_info.primary_vars)
+        columns = []
+        for column in cls_info.columns:
+            variable = obj_info.variables[column]
+            if variable.is_defined():
+                columns.append(column)
+            elif isinstance(variable.get_lazy(), Expr):
+                return None
+        if not columns:
+            return None
+        if not self._connection.batch_insert_identities:
+            for variable in obj_info.primary_vars:
+                if not variable.is_defined():
+                    return None
+        return columns
+
+    def _get_update_columns(self, obj_info):
+        """Return the columns the update of the given object sets.
+
+        None is returned if the object has to be updated on its own since
+        nothing changed, some of its new values are SQL expressions or its
+        primary key changed.
+        """
+        if "primary_vars" not in obj_info:
+            return None
+        cls_info = obj_info.cls_info
+        primary_key_idx = cls_info.primary_key_idx
+        columns = []
+        for column in cls_info.columns:
+            variable = obj_info.variables[column]
+            if variable.has_changed():
+                if (not variable.is_defined() or
+                    id(column) in primary_key_idx):
+                    return None
+                columns.append(column)
+        if not columns:
+            return None
+        return columns
+
+    def _flush_inserts(self, obj_infos):
+        """Insert the given objects, a batch as selected by L{flush},
+        with one multi-row insert."""
+        cls_info = obj_infos[0].cls_info
+        columns = self._get_insert_columns(obj_infos[0])
+        values = []
+        for obj_info in obj_infos:
+            del obj_info["pending"]
+            variables = obj_info.variables
+            values.append([variables[column] for column in columns])
+
+        result = self._connection.execute(
+            Insert(columns, cls_info.table, values=values))
+
+        # Read back the primary keys the database has set.
+        missing_columns = []
+        for i, variable in enumerate(obj_infos[0].primary_vars):
+            if not variable.is_defined():
+                missing_columns.append(cls_info.primary_key[i])
+        if missing_columns:
+            where, order_by = result.get_insert_identities(
+                cls_info.primary_key, len(obj_infos))
+            result = self._connection.execute(
+                Select(missing_columns, where, order_by=order_by))
+            rows = result.get_all()
+            if len(rows) != len(obj_infos):
+                raise StoreError("Can't identify the %d inserted rows of %s" %
+                                 (len(obj_infos), cls_info.table))
+            for obj_info, row in zip(obj_infos, rows):
+                variables = obj_info.variables
+                for column, value in zip(missing_columns, row):
+                    result.set_variable(variables[column], value)
+
+        for obj_info in obj_infos:
+            # We're sure the cache is valid at this point. We just added
+            # the object.
+            obj_info.pop("invalidated", None)
+
+            self._fill_missing_values(obj_info, obj_info.primary_vars)
+
+            self._enable_change_notification(obj_info)
+            self._add_to_alive(obj_info)
+
+        for obj_info in obj_infos:
+            self._run_hook(obj_info, "__storm_flushed__")
+
+            obj_info.event.emit("flushed")
+
+    def _flush_removes(self, obj_infos):
+        """Delete the given objects, a batch as selected by L{flush},
+        with one delete."""
+        cls_info = obj_infos[0].cls_info
+        primary_key = cls_info.primary_key
+        if len(primary_key) == 1:
+            where = primary_key[0].is_in(
+                [obj_info["primary_vars"][0] for obj_info in obj_infos])
+        else:
+            where = Or(*[compare_columns(primary_key, obj_info["primary_vars"])
+                         for obj_info in obj_infos])
+        for obj_info in obj_infos:
+            del obj_info["pending"]
+        self._connection.execute(Delete(where, cls_info.table), noresult=True)
+
+        for obj_info in obj_infos:
+            # We're sure the cache is valid at this point.
+            obj_info.pop("invalidated", None)
+
+            self._disable_change_notification(obj_info)
+            self._remove_from_alive(obj_info)
+            del obj_info["store"]
+
+        for obj_info in obj_infos:
+            self._run_hook(obj_info, "__storm_flushed__")
+
+            obj_info.event.emit("flushed")
+
+    def _flush_updates(self, obj_infos):
+        """Update the given objects, a batch as selected by L{flush}.
+
+        Objects getting the same values are updated together with a single
+        update, and the remaining ones with one L{executemany} call.
+        """
+        cls_info = obj_infos[0].cls_info
+        primary_key = cls_info.primary_key
+        columns = self._get_update_columns(obj_infos[0])
+        groups = {}
+        singles = []
+        for obj_info in obj_infos:
+            variables = obj_info.variables
+            values = tuple(variables[column].get(to_db=True)
+                           for column in columns)
+            try:
+                groups.setdefault(values, []).append(obj_info)
+            except TypeError:
+                # Unhashable values, like those of lists.
+                singles.append(obj_info)
+        for group in groups.itervalues():
+            if len(group) == 1:
+                singles.extend(group)
+                continue
+            variables = group[0].variables
+            changes = dict((column, variables[column]) for column in columns)
+            if len(primary_key) == 1:
+                where = primary_key[0].is_in(
+                    [obj_info["primary_vars"][0] for obj_info in group])
+            else:
+                where = Or(*[compare_columns(primary_key,
+                                             obj_info["primary_vars"])
+                             for obj_info in group])
+            self._connection.execute(Update(changes, where, cls_info.table),
+                                     noresult=True)
+        if len(singles) == 1:
+            variables = singles[0].variables
+            changes = dict((column, variables[column]) for column in columns)
+            where = compare_columns(primary_key, singles[0]["primary_vars"])
+            self._connection.execute(Update(changes, where, cls_info.table),
+                                     noresult=True)
+        elif singles:
+            # Compile the update once, with placeholder variables whose
+            # position in the parameters tells which values they stand for.
+            placeholders = {}
+            changes = {}
+            for column in columns:
+                variable = changes[column] = column.variable_factory()
+                placeholders[id(variable)] = (True, column)
+            primary_vars = []
+            for i, column in enumerate(primary_key):
+                variable = column.variable_factory()
+                placeholders[id(variable)] = (False, i)
+                primary_vars.append(variable)
+            state = State()
+            statement = self._connection.compile(
+                Update(changes, compare_columns(primary_key, primary_vars),
+                       cls_info.table), state)
+            slots = [placeholders[id(variable)]
+                     for variable in state.parameters]
+            params = []
+            for obj_info in singles:
+                variables = obj_info.variables
+                cached_primary_vars = obj_info["primary_vars"]
+                row = []
+                for is_change, key in slots:
+                    if is_change:
+                        row.append(variables[key])
+                    else:
+                        row.append(cached_primary_vars[key])
+                params.append(row)
+            self._connection.executemany(statement, params)
+
+        for obj_info in obj_infos:
+            self._fill_missing_values(obj_info, obj_info.primary_vars)
+
+            self._add_to_alive(obj_info)
+
+        for obj_info in obj_infos:
+            self._run_hook(obj_info, "__storm_flushed__")
+
+            obj_info.event.emit("flushed")
+
     def _flush_one(self, obj_info):
         cls_info = obj_info.cls_info
 
@@ -691,6 +1124,7 @@ class Store(object):
             # Found object in cache, and it must be valid since the
             # primary key was extracted from result values.
             obj_info.pop("invalidated", None)
+            self._count("load_hits", obj_info)
 
             # Take that chance and fill up any undefined variables
             # with fresh data, since we got it anyway.
@@ -713,6 +1147,7 @@ class Store(object):
             self._add_to_alive(obj_info)
             self._enable_change_notification(obj_info)
             self._enable_lazy_resolving(obj_info)
+            self._count("load_builds", obj_info)
 
             self._run_hook(obj_info, "__storm_loaded__")
 
@@ -729,6 +1164,7 @@ class Store(object):
             # Re-enable change notification, as it may have been implicitely
             # disabled when the previous object has been collected
             self._enable_change_notification(obj_info)
+            self._count("rebuilds", obj_info)
             self._run_hook(obj_info, "__storm_loaded__")
         # Renew the cache.
         self._cache.add(obj_info)
@@ -778,6 +1214,7 @@ class Store(object):
         if obj_info not in self._dirty:
             self._dirty[obj_info] = obj_info.get_obj()
             obj_info["sequence"] = self._sequence = self._sequence + 1
+            self._generation += 1
 
     def _set_clean(self, obj_info):
         self._dirty.pop(obj_info, None)
@@ -888,6 +1325,7 @@ class Store(object):
                 autoreload_columns.append(column)
 
         if autoreload_columns:
+            self._count("autoreloads", obj_info)
             where = compare_columns(obj_info.cls_info.primary_key,
                                     obj_info["primary_vars"])
             result = self._connection.execute(
@@ -920,6 +1358,9 @@ class ResultSet(object):
         self._distinct = False
         self._group_by = Undef
         self._having = Undef
+        self._prefetch = ()
+        self._eager = ()
+        self._eager_width = 0
 
     def copy(self):
         """Return a copy of this ResultSet object, with the same configuration.
@@ -964,20 +1405,115 @@ class ResultSet(object):
                 self._select.offset = self._offset
             return self._select
         columns, default_tables = self._find_spec.get_columns_and_tables()
-        return Select(columns, self._where, self._tables, default_tables,
+        tables = self._tables
+        if self._eager:
+            joins = []
+            for position, cls_info, join, link in self._eager:
+                columns.extend(cls_info.columns)
+                joins.append(join)
+            if tables is Undef:
+                # Joins are only known to the compiler as auto tables,
+                # so inject them along with the first joined column.
+                index = len(columns) - self._eager_width
+                columns[index] = AutoTables(columns[index], joins)
+            elif type(tables) in (list, tuple):
+                tables = list(tables) + joins
+            else:
+                tables = [tables] + joins
+        return Select(columns, self._where, tables, default_tables,
                       self._order_by, offset=self._offset, limit=self._limit,
                       distinct=self._distinct, group_by=self._group_by,
                       having=self._having)
 
+    def _set_eager(self, references):
+        """Load the objects of the given references in the same query.
+
+        See the C{eager} parameter of L{Store.find}.
+        """
+        eager = []
+        for reference in references:
+            eager_join = getattr(reference, "_eager_join", None)
+            if eager_join is None:
+                raise FeatureError("Can't eager load %r" % (reference,))
+            position = self._find_spec.get_position(reference._cls)
+            if position is None:
+                raise FeatureError("%r isn't a reference of the classes "
+                                   "being found" % (reference,))
+            cls_info, join, link = eager_join
+            eager.append((position, cls_info, join, link))
+            self._eager_width += len(cls_info.columns)
+        self._eager += tuple(eager)
+
     def _load_objects(self, result, values):
-        return self._find_spec.load_objects(self._store, result, values)
+        if not self._eager:
+            return self._find_spec.load_objects(self._store, result, values)
+        start = len(values) - self._eager_width
+        objects = self._find_spec.load_objects(self._store, result,
+                                               values[:start])
+        if self._find_spec.is_tuple:
+            items = objects
+        else:
+            items = (objects,)
+        for position, cls_info, join, link in self._eager:
+            end = start + len(cls_info.columns)
+            remote = self._store._load_object(cls_info, result,
+                                              values[start:end])
+            local = items[position]
+            if remote is not None and local is not None:
+                link(local, remote)
+            start = end
+        return objects
 
     def __iter__(self):
         """Iterate the results of the query.
         """
         result = self._store._connection.execute(self._get_select())
-        for values in result:
-            yield self._load_objects(result, values)
+        if not self._prefetch:
+            for values in result:
+                yield self._load_objects(result, values)
+            return
+        rows = iter(result)
+        while True:
+            batch = [self._load_objects(result, values)
+                     for values in islice(rows, BATCH_SIZE)]
+            if not batch:
+                break
+            for reference in self._prefetch:
+                cls = reference._cls
+                if self._find_spec.is_tuple:
+                    objects = [obj for item in batch for obj in item
+                               if isinstance(obj, cls)]
+                else:
+                    objects = [obj for obj in batch if isinstance(obj, cls)]
+                reference._prefetch(self._store, objects)
+            for item in batch:
+                yield item
+
+    def prefetch(self, *references):
+        """Load the objects referenced by the objects found in batches.
+
+        When the results are iterated, the objects referenced by each
+        batch of found objects through the given L{Reference} or
+        L{ReferenceSet} properties are loaded with one query per batch,
+        so accessing them afterwards doesn't query the database again::
+
+            for entry in store.find(LogEntry).prefetch(LogEntry.activity):
+                print entry.activity.name
+
+        The objects of a reference set are reused until an object of the
+        store gets dirty, flushed or invalidated, after which the reference
+        set is queried again when iterated.
+
+        @param references: Reference or ReferenceSet properties of the
+            class (or, when finding tuples, of any class) being found.
+
+        @return: self (not a copy).
+        """
+        for reference in references:
+            if getattr(reference, "_prefetch", None) is None:
+                raise FeatureError("Can't prefetch %r" % (reference,))
+        self._prefetch += references
+        return self
 
     def __getitem__(self, index):
         """Get an individual item by offset, or a range of items by slice.
@@ -1460,6 +1996,8 @@ class ResultSet(object):
     def _set_expr(self, expr_cls, other, all=False):
         if not self._find_spec.is_compatible(other._find_spec):
             raise FeatureError("Incompatible results for set operation")
+        if self._eager or other._eager:
+            raise FeatureError("Can't eager load references in set operations")
 
         expr = expr_cls(self._get_select(), other._get_select(), all=all)
         return ResultSet(self._store, self._find_spec, select=expr)
@@ -1552,6 +2090,9 @@ class EmptyResultSet(object):
         self._order_by = True
         return self
 
+    def prefetch(self, *references):
+        return self
+
     def remove(self):
         return 0
 
@@ -1633,10 +2174,14 @@ class TableSet(object):
         """
         if self._store._implicit_flush_block_count == 0:
             self._store.flush()
+        eager = kwargs.pop("eager", None)
         find_spec = FindSpec(cls_spec)
         where = get_where_for_args(args, kwargs, find_spec.default_cls)
-        return self._store._result_set_factory(self._store, find_spec,
-                                               where, self._tables)
+        result_set = self._store._result_set_factory(self._store, find_spec,
+                                                     where, self._tables)
+        if eager:
+            result_set._set_eager(eager)
+        return result_set
 
 
 Store._result_set_factory = ResultSet
@@ -1682,6 +2227,14 @@ class FindSpec(object):
                 default_tables.append(info.table)
         return columns, default_tables
 
+    def get_position(self, cls):
+        """Return the position of the first item which is an instance of
+        C{cls}, or None if there's no such item."""
+        for position, (is_expr, info) in enumerate(self._cls_spec_info):
+            if not is_expr and issubclass(info.cls, cls):
+                return position
+        return None
+
     def is_compatible(self, find_spec):
         """Return True if this FindSpec is compatible with a second one."""
         if self.is_tuple != find_spec.is_tuple:
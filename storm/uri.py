@@ -18,7 +18,6 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
-from urllib import quote
 
 from storm.exceptions import URIError
 
@@ -109,6 +108,9 @@ class URI(object):
 
 
 def escape(s, safe=""):
+    # URIs are only escaped when turned back into strings, so urllib isn't
+    # imported along with the module.
+    from urllib import quote
     return quote(s, safe)
 
 
@@ -22,10 +22,6 @@ from datetime import datetime, date, time, timedelta
 from decimal import Decimal
 import cPickle as pickle
 import re
-try:
-    import uuid
-except ImportError:
-    uuid = None
 
 from storm.compat import json
 from storm.exceptions import NoneError
@@ -43,6 +39,7 @@ __all__ = [
     "RawStrVariable",
     "UnicodeVariable",
     "DateTimeVariable",
+    "EpochDateTimeVariable",
     "DateVariable",
     "TimeVariable",
     "TimeDeltaVariable",
@@ -431,6 +428,58 @@ class DateTimeVariable(Variable):
         return value
 
 
+class EpochDateTimeVariable(Variable):
+    """A datetime stored in the database as an integer.
+
+    The database value is the number of seconds (or microseconds, if the
+    C{microseconds} argument is true) since 1970-01-01 00:00:00, so that
+    values can be loaded without string parsing and are compared as
+    integers by the database.  Naive datetimes are stored as they are,
+    aware ones are converted to UTC first.
+    """
+    __slots__ = ("_microseconds", "_tzinfo")
+
+    def __init__(self, *args, **kwargs):
+        self._microseconds = kwargs.pop("microseconds", False)
+        self._tzinfo = kwargs.pop("tzinfo", None)
+        super(EpochDateTimeVariable, self).__init__(*args, **kwargs)
+
+    def parse_set(self, value, from_db):
+        if from_db:
+            if not isinstance(value, (int, long)):
+                raise TypeError("Expected int, found %r: %r"
+                                % (type(value), value))
+            if self._microseconds:
+                value = _EPOCH + timedelta(microseconds=value)
+            else:
+                value = _EPOCH + timedelta(seconds=value)
+            if self._tzinfo is not None:
+                value = self._tzinfo.fromutc(
+                    value.replace(tzinfo=self._tzinfo))
+        else:
+            if type(value) in (int, long, float):
+                value = datetime.utcfromtimestamp(value)
+            elif not isinstance(value, datetime):
+                raise TypeError("Expected datetime, found %s" % repr(value))
+            if not self._microseconds:
+                # Keep the value in sync with what the database will hold.
+                value = value.replace(microsecond=0)
+            if self._tzinfo is not None:
+                value = value.astimezone(self._tzinfo)
+        return value
+
+    def parse_get(self, value, to_db):
+        if to_db:
+            if value.tzinfo is not None:
+                value = value.replace(tzinfo=None) - value.utcoffset()
+            delta = value - _EPOCH
+            seconds = delta.days * 86400 + delta.seconds
+            if self._microseconds:
+                return seconds * 1000000 + delta.microseconds
+            return seconds
+        return value
+
+
 class DateVariable(Variable):
     __slots__ = ()
 
@@ -497,10 +546,21 @@ class TimeDeltaVariable(Variable):
             return value
 
 
+# The uuid module is imported by UUIDVariable on first use, since importing
+# it probes for the native uuid libraries and pulls in ctypes and subprocess.
+uuid = None
+
+
 class UUIDVariable(Variable):
     __slots__ = ()
 
     def parse_set(self, value, from_db):
+        global uuid
+        if uuid is None:
+            try:
+                import uuid
+            except ImportError:
+                pass
         assert uuid is not None, "The uuid module was not found."
         if from_db and isinstance(value, basestring):
             value = uuid.UUID(value)
@@ -681,6 +741,9 @@ class ListVariable(MutableValueVariable):
         self._value = pickle.loads(state[1])
 
 
+_EPOCH = datetime(1970, 1, 1)
+
+
 def _parse_time(time_str):
     # TODO Add support for timezones.
     colons = time_str.count(":")
@@ -18,13 +18,99 @@
 #
 ########################################################################
 import sys
-import sqlite3
+import re
+import csv
+import json
 import datetime
+import time
 import gettext
-import string
 from getch import getch
 from menu import Menu, uraw_input, choose_dialog
-from storm.locals import *
+from storm.locals import Int, Unicode, Bool, Date, EpochDateTime, Reference
+from storm.locals import Store, create_database, Insert, Desc, And, Or
+from storm.schema import Schema
+import patches
+
+# Statements creating the current schema from scratch. Existing databases are
+# brought up to date by the modules of the patches package instead.
+SCHEMA_CREATES = [
+    "CREATE TABLE activities (id INTEGER PRIMARY KEY, name TEXT, is_work INT)",
+    "CREATE TABLE timelog (id INTEGER PRIMARY KEY, activity_id INTEGER, "
+        "ts INTEGER, details TEXT)",
+    "CREATE TABLE daily_totals (day TEXT, activity_id INTEGER, "
+        "microseconds INTEGER, PRIMARY KEY (day, activity_id))",
+    "CREATE INDEX timelog_ts ON timelog (ts)",
+    "CREATE INDEX timelog_activity_id ON timelog (activity_id)",
+    ]
+SCHEMA_DROPS = [
+    "DROP TABLE daily_totals",
+    "DROP TABLE timelog",
+    "DROP TABLE activities",
+    ]
+SCHEMA_DELETES = [
+    "DELETE FROM daily_totals",
+    "DELETE FROM timelog",
+    "DELETE FROM activities",
+    ]
+
+# The column type affinities (see http://www.sqlite.org/datatype3.html) the
+# tables of an up to date database must have.
+SCHEMA_COLUMNS = {
+    "activities":   [("id", "INTEGER"), ("name", "TEXT"),
+                     ("is_work", "INTEGER")],
+    "timelog":      [("id", "INTEGER"), ("activity_id", "INTEGER"),
+                     ("ts", "INTEGER"), ("details", "TEXT")],
+    "daily_totals": [("day", "TEXT"), ("activity_id", "INTEGER"),
+                     ("microseconds", "INTEGER")],
+    }
+
+class SchemaError(Exception):
+    """Raised when the tables of a database don't have the expected
+    columns."""
+
+class ImportRecordError(ValueError):
+    """Raised by Timelog.import_log() for a record which can't be imported.
+    The line attribute is the number of the line of the file the record
+    ends on."""
+    def __init__(self, line, message):
+        ValueError.__init__(self, "line %d: %s" % (line, message))
+        self.line = line
+
+def column_affinity(declared_type):
+    """Return the SQLite type affinity of a column with the given declared
+    type."""
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return "INTEGER"
+    for name in ("CHAR", "CLOB", "TEXT"):
+        if name in declared_type:
+            return "TEXT"
+    if "BLOB" in declared_type or declared_type == "":
+        return "NONE"
+    for name in ("REAL", "FLOA", "DOUB"):
+        if name in declared_type:
+            return "REAL"
+    return "NUMERIC"
+
+# Number of log entries shown at once by TimelogUi.show_activity_log()
+LOG_PAGE_SIZE = 20
+
+# Timelog.import_log() inserts this many entries with each INSERT statement
+# (every entry takes three of the at most 999 parameters SQLite accepts) and
+# commits after this many entries.
+IMPORT_ROWS_PER_INSERT = 333
+IMPORT_ROWS_PER_COMMIT = 50000
+
+# Timestamps of imported entries, 'YYYY-MM-DD HH:MM:SS[.ffffff]'
+IMPORT_TS_RE = re.compile(r"(\d{4})-(\d\d)-(\d\d)[ T](\d\d):(\d\d):(\d\d)"
+                          r"(?:\.(\d{1,6}))?$")
+
+# The fields of the records written by Timelog.export() for each kind of
+# export. The "log" records can be read back by Timelog.import_log().
+EXPORT_FIELDS = {
+    "log":  ["ts", "activity", "is_work", "details"],
+    "days": ["day", "activity", "is_work", "hours", "details"],
+    }
 
 def date_is_today(d):
     now = datetime.datetime.now()
@@ -34,6 +120,81 @@ def date_is_today(d):
         return False
 
 
+def split_at_midnight(start, end):
+    """Split the interval [start, end) into pieces which don't extend over
+    midnight and yield them as (start, end) tuples."""
+    while True:
+        midnight = datetime.datetime( start.year, start.month, start.day )
+        midnight += datetime.timedelta(1)
+        if end <= midnight:
+            yield (start, end)
+            return
+        yield (start, midnight)
+        start = midnight
+
+
+def timedelta_microseconds(delta):
+    """Return the number of microseconds in the given datetime.timedelta.
+    The timestamps are whole microseconds, so intervals are added up and
+    split exactly."""
+    return (delta.days*24*60*60 + delta.seconds)*1000000 + delta.microseconds
+
+def microseconds_to_hours(microseconds):
+    """Convert a number of microseconds to hours, for display, counting
+    whole minutes only."""
+    return float(microseconds // 60000000) / 60
+
+
+def parse_import_record(record):
+    """Convert a record read by Timelog.import_log() into a tuple
+    (timestamp, activity name, is_work, details). Raises ValueError if the
+    record is malformed."""
+    def text(field):
+        value = record.get(field)
+        if not isinstance(value, basestring):
+            raise ValueError("%s must be a string, not %r" % (field, value))
+        if isinstance(value, str):
+            try:
+                value = value.decode("utf-8")
+            except UnicodeDecodeError:
+                raise ValueError("%s is not UTF-8: %r" % (field, value))
+        return value
+    if not isinstance(record, dict):
+        raise ValueError("Not a record: %r" % (record,))
+    match = IMPORT_TS_RE.match(text("ts").strip())
+    if match is None:
+        raise ValueError("Invalid timestamp %r" % record["ts"])
+    fields = match.groups()
+    try:
+        ts = datetime.datetime( *[int(field) for field in fields[:6]] +
+                                [int((fields[6] or "").ljust(6, "0"))] )
+    except ValueError, e:
+        raise ValueError("Invalid timestamp %r: %s" % (record["ts"], e))
+    name = text("activity")
+    if not name.strip():
+        raise ValueError("Empty activity name")
+    is_work = record.get("is_work") or False
+    if isinstance(is_work, basestring):
+        is_work = text("is_work").strip().lower() in (u"1", u"true", u"work")
+    details = u""
+    if record.get("details") is not None:
+        details = text("details")
+    return (ts, name, bool(is_work), details)
+
+
+def export_value(value, format):
+    """Convert a field of a record written by Timelog.export() into a value
+    the writer of the given format ("csv" or "json") can handle."""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return str(value)
+    if format == "csv":
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+    return value
+
+
 def num_to_menu(i):
     if i<10:
         return str(i)
@@ -52,30 +213,571 @@ class LogEntry(object):
     id = Int(primary=True)
     activity_id = Int()
     activity = Reference(activity_id, Activity.id)
-    ts = DateTime()
+    ts = EpochDateTime(microseconds=True)
     details = Unicode()
 
+class DailyTotal(object):
+    """Rollup of the timelog: the number of microseconds spent on an activity
+    on a given day. Only closed intervals are accounted, the interval of the
+    most recent log entry is still running and has to be added on the fly."""
+    __storm_table__ = "daily_totals"
+    __storm_primary__ = "day", "activity_id"
+    day = Date()
+    activity_id = Int()
+    microseconds = Int()
+
+class RangeReport:
+    """Activity report over a time window, as returned by
+    Timelog.range_report(). It has the following attributes:
+
+      days   -- a list of (date, day report) tuples for every day of the
+                window; the day reports have the form used by
+                Timelog.day_report()
+      weeks  -- a dictionary mapping (ISO year, ISO week) to the totals of
+                that week
+      months -- a dictionary mapping (year, month) to the totals of that
+                month
+
+    The totals are dictionaries mapping (is_work, activity name) to the
+    number of microseconds spent on that activity. Reports built from the
+    daily_totals rollup by Timelog.totals_report() have no days."""
+    def __init__(self):
+        self.days   = []
+        self.weeks  = {}
+        self.months = {}
+
+    def add_interval(self, start, end, name, is_work):
+        """Account the interval [start, end), which must not extend over
+        midnight, to the week and month totals."""
+        self.add_microseconds(start.date(), name, is_work,
+                              timedelta_microseconds(end-start))
+
+    def add_microseconds(self, day, name, is_work, microseconds):
+        """Account the given number of microseconds spent on the given day to
+        the week and month totals."""
+        key = (is_work, name)
+        (iso_year, iso_week, iso_weekday) = day.isocalendar()
+        for (totals, period) in ( (self.weeks,  (iso_year, iso_week)),
+                                  (self.months, (day.year, day.month)) ):
+            period_totals = totals.setdefault(period, {})
+            period_totals[key] = period_totals.get(key, 0) + microseconds
+
+class ActivityCatalogue:
+    """In-process cache of the activities table, mapping the activity ids to
+    (name, is_work) tuples. It is loaded with one query on first use and has
+    to be invalidated whenever activities are added or changed."""
+    def __init__(self, store):
+        self.store = store
+        self._activities = None
+        self._unknown = set()
+
+    def invalidate(self):
+        self._activities = None
+        self._unknown.clear()
+
+    def all(self):
+        """Return the dictionary mapping all activity ids to (name, is_work)
+        tuples."""
+        if self._activities is None:
+            activities = self.store.find( Activity )
+            self._activities = dict( [ (id, (name, is_work))
+                for (id, name, is_work) in activities.values( Activity.id,
+                    Activity.name, Activity.is_work ) ] )
+        return self._activities
+
+    def get(self, activity_id):
+        """Return the (name, is_work) tuple of the given activity. Activities
+        not known yet cause a reload of the catalogue, since they may have
+        been added by another process; ("", False) is returned for
+        activities which don't exist at all."""
+        activities = self.all()
+        if not activity_id in activities and \
+           not activity_id in self._unknown:
+            self.invalidate()
+            activities = self.all()
+            if not activity_id in activities:
+                self._unknown.add(activity_id)
+        return activities.get(activity_id, ("", False))
+
 class Timelog:
-    def __init__(self, db_file):
+    def __init__(self, db_file, profile=None):
+        """Keep the log in the SQLite database db_file. profile names the
+        set of PRAGMAs the connections are configured with ("fast" or
+        "safe", see storm.databases.sqlite.PRAGMA_PROFILES), None keeps the
+        SQLite defaults."""
         self.db_file = db_file
+        self.profile = profile
+        self.stale_totals = False
 
     def init(self):
-        conn = sqlite3.connect(self.db_file, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-        cur = conn.cursor()
-        cur.execute("select name from SQLite_Master")
-        tables = map(lambda x: x[0], cur.fetchall())
-
-        # TODO: also check that the existing tables have the correct data-types
-        if not "activities" in tables:
-            cur.execute("create table activities (id integer primary key, name text, is_work int)")
-        if not "timelog" in tables:
-            cur.execute("create table timelog (id integer primary key, activity_id integer, ts text, details text)")
-        cur.close()
-        conn.close()
-
-    def open(self):
-        self.database = create_database("sqlite:%s" % self.db_file)
+        """Create the database schema, or upgrade the schema of an existing
+        database by applying the missing patches, and verify the column
+        types of the resulting tables."""
+        store = Store(create_database("sqlite:%s" % self.db_file))
+        try:
+            tables = self._get_tables(store)
+            if tables and not "patch" in tables:
+                # The database was created before the schema was versioned,
+                # so all the patches have to be applied to it.
+                store.execute("CREATE TABLE patch "
+                              "(version INTEGER NOT NULL PRIMARY KEY)")
+                store.commit()
+            schema = Schema(SCHEMA_CREATES, SCHEMA_DROPS, SCHEMA_DELETES,
+                            patches)
+            schema.upgrade(store)
+            self._verify_schema(store)
+            if not "daily_totals" in tables or self._rollup_is_empty(store):
+                self.stale_totals = True
+        finally:
+            store.close()
+
+    def _rollup_is_empty(self, store):
+        """Return True if the daily_totals rollup is empty even though the
+        timelog has closed intervals."""
+        result = store.execute("SELECT COUNT(*) FROM "
+                               "(SELECT 1 FROM timelog LIMIT 2)")
+        if result.get_one()[0] < 2:
+            return False
+        result = store.execute("SELECT 1 FROM daily_totals LIMIT 1")
+        return result.get_one() is None
+
+    def _get_tables(self, store):
+        result = store.execute("SELECT name FROM sqlite_master "
+                               "WHERE type = 'table'")
+        return [name for (name,) in result]
+
+    def _verify_schema(self, store):
+        """Raise SchemaError if a table doesn't have the expected columns."""
+        mismatches = []
+        for table in sorted(SCHEMA_COLUMNS):
+            result = store.execute("PRAGMA table_info(%s)" % table)
+            columns = [(row[1], column_affinity(row[2])) for row in result]
+            if columns != SCHEMA_COLUMNS[table]:
+                mismatches.append("%s %r (expected %r)" % (
+                    table, columns, SCHEMA_COLUMNS[table]))
+        if mismatches:
+            raise SchemaError("Unexpected columns in %s: %s" % (
+                self.db_file, "; ".join(mismatches)))
+
+    def open(self, read_only=False):
+        """Connect to the database.
+
+        A read-only Timelog, meant for reports and exports, never starts a
+        transaction. If the profile puts the database in WAL mode, the reads
+        outside of write transactions go to a separate read-only connection
+        and write transactions take the database lock right when they begin,
+        so concurrent writers wait for each other instead of failing.
+        Without WAL a reader would block the commits of the writer, and
+        reads have to share the transactions of the writes."""
+        # The backend is imported here, as create_database() would, so that
+        # importing this module doesn't load it.
+        from storm.databases.sqlite import PRAGMA_PROFILES
+        options = []
+        if self.profile is not None:
+            options.append("profile=%s" % self.profile)
+        if read_only:
+            options.append("mode=ro")
+        elif self.profile is not None and \
+             PRAGMA_PROFILES[self.profile].get("journal_mode") == "WAL":
+            options.extend(["readers=1", "begin=immediate"])
+        uri = "sqlite:%s" % self.db_file
+        if options:
+            uri += "?" + "&".join(options)
+        self.database = create_database(uri)
         self.store    = Store(self.database)
+        self.catalogue = ActivityCatalogue(self.store)
+        if self.stale_totals and not read_only:
+            self.rebuild_daily_totals()
+
+    def add_activity(self, name, is_work):
+        """Add a new activity and return its id."""
+        act = Activity()
+        act.name = unicode(name)
+        act.is_work = is_work
+        self.store.add(act)
+        self.store.commit()
+        self.catalogue.invalidate()
+        return act.id
+
+    def log_activity(self, activity_id, details, timestamp):
+        """Log the start of the given activity at the given timestamp and
+        keep the daily_totals rollup up to date.
+
+        Only the interval affected by the new entry is accounted: appending
+        an entry closes the interval of the previously last entry, while a
+        backdated entry takes over the remainder of the interval of the entry
+        logged before it, up to the next entry."""
+        tl = LogEntry()
+        tl.activity_id = activity_id
+        tl.ts = timestamp
+        tl.details = unicode(details)
+        self.store.add(tl)
+        # Inserting the entry first begins the write transaction, so the
+        # entries around it can't change before the rollup is updated.
+        self.store.flush()
+
+        previous = self.store.find( LogEntry, LogEntry.ts <= timestamp,
+                                    LogEntry.id != tl.id )
+        previous = previous.order_by( Desc(LogEntry.ts), Desc(LogEntry.id) )
+        previous = previous.config(limit=1)
+        previous = next( previous.values( LogEntry.ts, LogEntry.activity_id ),
+                         None )
+        following = self.store.find( LogEntry, LogEntry.ts > timestamp )
+        following = following.order_by( LogEntry.ts ).config(limit=1)
+        next_ts = next( following.values( LogEntry.ts ), None )
+        if next_ts is None:
+            if previous is not None:
+                (previous_ts, previous_id) = previous
+                self._add_daily_totals(previous_id, previous_ts, timestamp, 1)
+        else:
+            if previous is not None:
+                self._add_daily_totals(previous[1], timestamp, next_ts, -1)
+            self._add_daily_totals(activity_id, timestamp, next_ts, 1)
+        self.store.commit()
+
+    def import_log(self, stream, format="csv"):
+        """Import log entries from the given file object and return their
+        number.
+
+        The file is read either as CSV with a header line (format "csv") or
+        as one JSON object per line (format "json"). The fields of each
+        entry are ts (in the form 'YYYY-MM-DD HH:MM:SS[.ffffff]'), activity
+        (the activity name), details and optionally is_work, which is used
+        when the activity doesn't exist yet and has to be created.
+
+        The file is streamed and the entries are inserted with multi-row
+        INSERT statements in large transactions instead of one object and
+        commit per entry. The daily_totals rollup is rebuilt afterwards.
+
+        The rollup is emptied in the first transaction, so if the import
+        doesn't complete, init() finds it empty and has it rebuilt.
+
+        A malformed record raises ImportRecordError. The entries of the
+        transactions committed before it stay imported, the rollup is
+        rebuilt nevertheless."""
+        activity_ids = {}
+        for (id, (name, is_work)) in sorted(self.catalogue.all().items(),
+                                            reverse=True):
+            activity_ids[name] = id
+        count = 0
+        batch = []
+        # Until the rollup is rebuilt it misses the entries of the
+        # transactions committed so far.
+        self.stale_totals = True
+        try:
+            self.store.find( DailyTotal ).remove()
+            for (line, record) in self._iter_import_records(stream, format):
+                try:
+                    batch.append(parse_import_record(record))
+                except ValueError, e:
+                    raise ImportRecordError(line, str(e))
+                if len(batch) == IMPORT_ROWS_PER_INSERT:
+                    self._import_batch(batch, activity_ids)
+                    count += len(batch)
+                    batch = []
+                    if count % IMPORT_ROWS_PER_COMMIT < IMPORT_ROWS_PER_INSERT:
+                        self.store.commit()
+            if batch:
+                self._import_batch(batch, activity_ids)
+                count += len(batch)
+            self.store.commit()
+        except:
+            exc_info = sys.exc_info()
+            self.store.rollback()
+            self.catalogue.invalidate()
+            try:
+                self.rebuild_daily_totals()
+            except Exception:
+                # Leave the rollup to the next open(), the import error is
+                # the one to report.
+                pass
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self.catalogue.invalidate()
+        self.rebuild_daily_totals()
+        return count
+
+    def _iter_import_records(self, stream, format):
+        """Yield the records of an import file as (line number, record)
+        tuples, see import_log()."""
+        if format == "csv":
+            reader = csv.DictReader(stream)
+            try:
+                for record in reader:
+                    yield (reader.line_num, record)
+            except csv.Error, e:
+                raise ImportRecordError(reader.line_num, str(e))
+        else:
+            for (line, text) in enumerate(stream):
+                if not text.strip():
+                    continue
+                try:
+                    record = json.loads(text)
+                except ValueError, e:
+                    raise ImportRecordError(line+1, str(e))
+                yield (line+1, record)
+
+    def _import_batch(self, batch, activity_ids):
+        """Insert a batch of parsed import records, creating the activities
+        missing in activity_ids (a map of activity names to ids)."""
+        new_activities = {}
+        for (ts, name, is_work, details) in batch:
+            if not name in activity_ids:
+                new_activities.setdefault(name, is_work)
+        if new_activities:
+            values = [ ( Activity.name.variable_factory(value=name),
+                         Activity.is_work.variable_factory(value=is_work) )
+                       for (name, is_work) in new_activities.items() ]
+            self.store.execute( Insert( (Activity.name, Activity.is_work),
+                                        Activity, values=values ),
+                                noresult=True )
+            created = self.store.find( Activity,
+                          Activity.name.is_in(new_activities.keys()) )
+            for (id, name) in created.order_by( Desc(Activity.id) ).values(
+                    Activity.id, Activity.name ):
+                activity_ids[name] = id
+        values = [ ( LogEntry.activity_id.variable_factory(
+                         value=activity_ids[name]),
+                     LogEntry.ts.variable_factory(value=ts),
+                     LogEntry.details.variable_factory(value=details) )
+                   for (ts, name, is_work, details) in batch ]
+        self.store.execute( Insert( (LogEntry.activity_id, LogEntry.ts,
+                                     LogEntry.details),
+                                    LogEntry, values=values ),
+                            noresult=True )
+
+    def export(self, stream, kind="log", format="csv", start=None, end=None):
+        """Write the log entries (kind "log") or the day reports (kind "days")
+        within [start, end) to the given file object and return the number of
+        records written. start and end are of type datetime.datetime, None
+        meaning the beginning of the log and now respectively.
+
+        The file is written either as CSV with a header line (format "csv")
+        or as one JSON object per line (format "json"), with the fields given
+        in EXPORT_FIELDS. The records are streamed from the database cursor
+        to the file one by one, so the export runs in constant memory no
+        matter how long the history is."""
+        if kind == "log":
+            records = self.iter_log_records(start, end)
+        else:
+            if start is None:
+                first = self.store.find( LogEntry ).order_by( LogEntry.ts )
+                first = next( first.config(limit=1).values( LogEntry.ts ),
+                              datetime.datetime.now() )
+                start = datetime.datetime( first.year, first.month, first.day )
+            if end is None:
+                end = datetime.datetime.now()
+            records = self.iter_day_records(start, end)
+        fields = EXPORT_FIELDS[kind]
+        if format == "csv":
+            writer = csv.writer(stream)
+            writer.writerow(fields)
+        count = 0
+        for record in records:
+            values = [export_value(value, format) for value in record]
+            if format == "csv":
+                writer.writerow(values)
+            else:
+                stream.write(json.dumps(dict(zip(fields, values)),
+                                        sort_keys=True) + "\n")
+            count += 1
+        return count
+
+    def iter_log_records(self, start=None, end=None):
+        """Yield the log entries within [start, end) oldest first as tuples
+        (timestamp, activity name, is_work, details)."""
+        entries = self.store.find( LogEntry )
+        if start is not None:
+            entries = entries.find( LogEntry.ts >= start )
+        if end is not None:
+            entries = entries.find( LogEntry.ts < end )
+        entries = entries.order_by( LogEntry.ts, LogEntry.id )
+        for (ts, activity_id, details) in entries.values( LogEntry.ts,
+                LogEntry.activity_id, LogEntry.details ):
+            (name, is_work) = self.catalogue.get(activity_id)
+            yield (ts, name, is_work, details)
+
+    def iter_day_records(self, start, end):
+        """Yield the activities of the day reports of the days within
+        [start, end) as tuples (date, activity name, is_work, hours,
+        details). The "Total work" rows of the day reports are left out."""
+        for (day, rows) in self.iter_day_reports(start, end):
+            for (is_work, hours, name, details) in rows[:-1]:
+                yield (day, name, is_work, hours, details)
+
+    def _add_daily_totals(self, activity_id, start, end, sign):
+        """Add (sign 1) or subtract (sign -1) the interval [start, end) to or
+        from the daily_totals of the given activity."""
+        pieces = list(split_at_midnight(start, end))
+        keys = [(piece_start.date(), activity_id)
+                for (piece_start, piece_end) in pieces]
+        totals = self.store.get_many(DailyTotal, keys)
+        for ((piece_start, piece_end), key, total) in zip(pieces, keys, totals):
+            microseconds = sign * timedelta_microseconds(piece_end -
+                                                         piece_start)
+            if total is None:
+                total = DailyTotal()
+                (total.day, total.activity_id) = key
+                total.microseconds = 0
+                self.store.add(total)
+            total.microseconds += microseconds
+            if total.microseconds == 0:
+                self.store.remove(total)
+
+    def rebuild_daily_totals(self):
+        """Regenerate the daily_totals rollup from scratch with one scan over
+        the timelog."""
+        totals = {}
+        entries = self.store.find( LogEntry ).order_by( LogEntry.ts,
+                                                        LogEntry.id )
+        previous = None
+        for (ts, activity_id) in entries.values( LogEntry.ts,
+                                                 LogEntry.activity_id ):
+            if previous is not None:
+                for (start, end) in split_at_midnight(previous[0], ts):
+                    key = (start.date(), previous[1])
+                    totals[key] = totals.get(key, 0) + \
+                                  timedelta_microseconds(end-start)
+            previous = (ts, activity_id)
+        self.store.find( DailyTotal ).remove()
+        values = [ ( DailyTotal.day.variable_factory(value=day),
+                     DailyTotal.activity_id.variable_factory(value=activity_id),
+                     DailyTotal.microseconds.variable_factory(
+                         value=microseconds) )
+                   for ((day, activity_id), microseconds)
+                   in totals.iteritems()
+                   if microseconds != 0 ]
+        columns = (DailyTotal.day, DailyTotal.activity_id,
+                   DailyTotal.microseconds)
+        for i in range(0, len(values), IMPORT_ROWS_PER_INSERT):
+            chunk = values[i:i+IMPORT_ROWS_PER_INSERT]
+            self.store.execute( Insert( columns, DailyTotal, values=chunk ),
+                                noresult=True )
+        self.store.commit()
+        self.stale_totals = False
+
+    def log_page(self, key=None, limit=20):
+        """Return the most recent log entries, up to limit of them, as a list
+        of (timestamp, activity name, details) tuples, newest first.
+
+        The page is selected by key: pass None for the most recent entries
+        and the key returned with a page to get the entries before it. The
+        returned key is None when there are no older entries. Paging by the
+        (ts, id) key instead of an offset keeps every page an index range
+        scan, no matter how far back in the history it is."""
+        entries = self.store.find( LogEntry )
+        if key is not None:
+            (ts, id) = key
+            entries = entries.find( Or( LogEntry.ts < ts,
+                                        And( LogEntry.ts == ts,
+                                             LogEntry.id < id ) ) )
+        entries = entries.order_by( Desc(LogEntry.ts), Desc(LogEntry.id) )
+        rows = list( entries.config(limit=limit+1).values( LogEntry.id,
+                         LogEntry.ts, LogEntry.activity_id, LogEntry.details ) )
+        next_key = None
+        if len(rows) > limit:
+            del rows[limit:]
+            next_key = (rows[-1][1], rows[-1][0])
+
+        page = [ (ts, self.catalogue.get(activity_id)[0], details)
+                 for (id, ts, activity_id, details) in rows ]
+        return (page, next_key)
+
+    def totals_report(self, start, end):
+        """Return a RangeReport with the week and month totals of the days
+        within [start, end) (both of type datetime.date), read from the
+        daily_totals rollup instead of scanning the timelog."""
+        report = RangeReport()
+        totals = self.store.find( DailyTotal, DailyTotal.day >= start,
+                                  DailyTotal.day < end )
+        for (day, activity_id, microseconds) in totals.values(
+                DailyTotal.day, DailyTotal.activity_id,
+                DailyTotal.microseconds ):
+            (name, is_work) = self.catalogue.get(activity_id)
+            report.add_microseconds(day, name, is_work, microseconds)
+
+        # The interval of the most recent entry isn't part of the rollup yet.
+        last = self.store.find( LogEntry )
+        last = last.order_by( Desc(LogEntry.ts), Desc(LogEntry.id) )
+        last = last.config(limit=1)
+        now = datetime.datetime.now()
+        window_start = datetime.datetime( start.year, start.month, start.day )
+        window_end = min( now, datetime.datetime( end.year, end.month,
+                                                  end.day ) )
+        for (ts, activity_id) in last.values( LogEntry.ts,
+                                              LogEntry.activity_id ):
+            (name, is_work) = self.catalogue.get(activity_id)
+            for (piece_start, piece_end) in split_at_midnight(
+                    max(ts, window_start), window_end):
+                if piece_start < piece_end:
+                    report.add_interval(piece_start, piece_end, name, is_work)
+        return report
+
+    def range_report(self, start, end):
+        """Generate an activity report for the time window [start, end)
+        (both of type datetime.datetime) with a single scan of the timelog.
+
+        Intervals are split at midnight, so an activity running over midnight
+        is accounted to both days. The activity running at the beginning of
+        the window is taken from the last entry logged before it. The result
+        is a RangeReport, see there for the layout of the aggregates."""
+        report = RangeReport()
+        report.days.extend( self.iter_day_reports(start, end, report) )
+        return report
+
+    def iter_day_reports(self, start, end, report=None):
+        """Yield the (date, day report) tuples of the days within the time
+        window [start, end) one at a time, see day_report() for the layout of
+        a day report. The intervals are also added to report, a RangeReport,
+        if one is given."""
+        now = datetime.datetime.now()
+        day = start.date()
+        intervals = self._iter_intervals(start, min(end, now))
+        interval = next(intervals, None)
+        while datetime.datetime(day.year, day.month, day.day) < end:
+            rows = []
+            totalwork = 0
+            while interval is not None and interval[0].date() == day:
+                (ivl_start, ivl_end, name, is_work, details) = interval
+                diff = microseconds_to_hours(
+                    timedelta_microseconds(ivl_end-ivl_start) )
+                if is_work:
+                    totalwork += diff
+                rows.append( (is_work, diff, name, details) )
+                if report is not None:
+                    report.add_interval(ivl_start, ivl_end, name, is_work)
+                interval = next(intervals, None)
+            total_details = ""
+            if date_is_today( day ):
+                total_details = _("until now (%s)") % now.strftime("%H:%M")
+            rows.append( (True, totalwork, _("Total work"), total_details) )
+            yield (day, rows)
+            day += datetime.timedelta(1)
+
+    def _iter_intervals(self, start, end):
+        """Yield the tuples (start, end, name, is_work, details) of all the
+        activity intervals within [start, end), split at midnight."""
+        if end <= start:
+            return
+        columns = (LogEntry.ts, LogEntry.activity_id, LogEntry.details)
+        current = ("", False, "")
+        previous = self.store.find( LogEntry, LogEntry.ts < start )
+        previous = previous.order_by( Desc(LogEntry.ts), Desc(LogEntry.id) )
+        for (ts, activity_id, details) in previous.config(limit=1).values(
+                *columns):
+            current = self.catalogue.get(activity_id) + (details,)
+        # Stream the entries of the whole window in one query, rather than
+        # querying each day (or entry) on its own.
+        entries = self.store.find( LogEntry, LogEntry.ts >= start,
+                                   LogEntry.ts < end )
+        entries = entries.order_by( LogEntry.ts, LogEntry.id )
+        ivl_start = start
+        for (ts, activity_id, details) in entries.values(*columns):
+            for piece in split_at_midnight(ivl_start, ts):
+                yield piece + current
+            ivl_start = ts
+            current = self.catalogue.get(activity_id) + (details,)
+        for piece in split_at_midnight(ivl_start, end):
+            yield piece + current
 
     def day_report(self, d):
         """Generate a list of activities for the given date d (type
@@ -90,51 +792,23 @@ class Timelog:
            and the numbers in the second column indicate the amount of hours
            spent on that activity"""
         # TODO: create nicer grouping by activity name
-        import time
-
         day_start = datetime.datetime( d.year, d.month, d.day,   0, 0, 0)
         day_end   = day_start + datetime.timedelta(1)
-        if date_is_today( d ):
-            day_end = datetime.datetime.now()
-        day_log = self.store.find( LogEntry, LogEntry.ts > day_start, LogEntry.ts < day_end ).order_by(LogEntry.ts)
-
-        start_times = [day_start] + map( lambda x: x.ts, day_log )
-        end_times   = map( lambda x: x.ts, day_log ) + [day_end]
-
-        report = []
-        totalwork = 0
-        for (idx, (start, end)) in enumerate(zip(start_times, end_times)):
-            activity_name = ""
-            activity_is_work = False
-            details = ""
-            if idx!=0:
-                activity = day_log[idx-1].activity
-                activity_name    = activity.name
-                activity_is_work = activity.is_work
-                details          = day_log[idx-1].details
-            diff = float( (end-start).seconds / 60) / 60
-            if activity_is_work:
-                totalwork += diff
-            report.append( ( activity_is_work, diff, activity_name, details) )
-        total_details = ""
-        if date_is_today( d ):
-            now = datetime.datetime.now()
-            total_details = _("until now (%s)") % now.strftime("%H:%M")
-        report.append( (True, totalwork, _("Total work"), total_details) )
-
-        return report
+        return self.range_report(day_start, day_end).days[0][1]
 
     def month_report(self, year, month):
         """Similar to day_report() this function will return an activity report
         of a whole month. The report is a list of tuples where each tuple
         consists of a date object and the day report for that date."""
-        import calendar
-        report = []
-        (start_day, end_day) = calendar.monthrange(year, month)
-        for day in range( 1, end_day+1 ):
-            d = datetime.date( year, month, day )
-            report.append( (d, self.day_report(d)) )
-        return report
+        month_start = datetime.datetime( year, month, 1 )
+        month_end = (month_start + datetime.timedelta(32)).replace(day=1)
+        return self.range_report(month_start, month_end).days
+
+    def year_report(self, year):
+        """Return the week and month totals of the whole given year as a
+        RangeReport."""
+        return self.totals_report(datetime.date(year, 1, 1),
+                                  datetime.date(year+1, 1, 1))
 
 class TimelogUi:
     def __init__(self, timelogdb):
@@ -145,51 +819,88 @@ class TimelogUi:
         new_activity = uraw_input(_("New activity: "))
         classification = choose_dialog(_("Is this activity work or leasure"), ["work", "leasure"])
     
-        act = Activity()
-        act.name = unicode(new_activity)
-        if classification == "work":
-            act.is_work = True
-        else:
-            act.is_work = False
-        self.tdb.store.add(act)
-        self.tdb.store.commit()
+        self.tdb.add_activity(new_activity, classification == "work")
     
     def list_activities(self):
-        all = self.tdb.store.find(Activity)
+        all = self.tdb.catalogue.all()
         print "\r"
         print _("Known activities:")+"\r"
-        for act in all:
+        for (id, (name, is_work)) in sorted(all.items()):
             classification = _("spare")
-            if act.is_work:
+            if is_work:
                 classification = _("work")
-            print " %u %-10s %s\r" % ( act.id, classification, act.name)
+            print " %u %-10s %s\r" % ( id, classification, name)
         print "\r"
     
     def choose_activity(self):
-        activities = self.tdb.store.find(Activity)
+        activities = sorted(self.tdb.catalogue.all().items())
         l = []
-        for idx, a in enumerate(activities):
-            l.append( (num_to_menu(idx+1), a.id, a.name) )
+        for idx, (id, (name, is_work)) in enumerate(activities):
+            l.append( (num_to_menu(idx+1), id, name) )
         selection = Menu( l ).choose()
         return selection
     
     def log_activity(self, activity_id, details, timestamp):
-        tl = LogEntry()
-        tl.activity_id = activity_id
-        tl.ts = timestamp
-        tl.details = unicode(details)
-        self.tdb.store.add(tl)
-        self.tdb.store.commit()
-    
-    def show_activity_log(self):
-        import time
-        all = self.tdb.store.find(LogEntry)
+        self.tdb.log_activity(activity_id, details, timestamp)
+
+    def rebuild_daily_totals(self):
+        print _("Rebuilding the daily totals")+"\r"
+        self.tdb.rebuild_daily_totals()
+
+    def import_log(self):
         print "\r"
-        print "---------------------------------------\r"
-        for log in all.order_by(LogEntry.ts):
-            print " %s -   %-20s %s\r" % (time.strftime("%Y.%m.%d %H:%M:%S", log.ts.timetuple()), log.activity.name, log.details)
-        print "---------------------------------------\r"
+        filename = uraw_input(_("File to import (.csv or JSON lines): "))
+        format = "json"
+        if filename.lower().endswith(".csv"):
+            format = "csv"
+        try:
+            stream = open(filename, "rb")
+        except IOError, e:
+            print _("Can't open the file: %s") % e
+            return
+        try:
+            count = self.tdb.import_log(stream, format)
+        except (IOError, ImportRecordError), e:
+            print _("Can't import the file: %s") % e
+            return
+        finally:
+            stream.close()
+        print _("Imported %u log entries") % count
+
+    def export_log(self):
         print "\r"
+        kind = choose_dialog(_("Export the log entries or the day reports"),
+                             ["log", "days"])
+        filename = uraw_input(_("File to export to (.csv or JSON lines): "))
+        format = "json"
+        if filename.lower().endswith(".csv"):
+            format = "csv"
+        try:
+            stream = open(filename, "wb")
+        except IOError, e:
+            print _("Can't open the file: %s") % e
+            return
+        try:
+            count = self.tdb.export(stream, kind, format)
+        finally:
+            stream.close()
+        print _("Exported %u records") % count
+    
+    def show_activity_log(self):
+        key = None
+        while True:
+            (entries, key) = self.tdb.log_page(key, LOG_PAGE_SIZE)
+            print "\r"
+            print "---------------------------------------\r"
+            for (ts, name, details) in reversed(entries):
+                print " %s -   %-20s %s\r" % (time.strftime("%Y.%m.%d %H:%M:%S", ts.timetuple()), name, details)
+            print "---------------------------------------\r"
+            print "\r"
+            if key is None:
+                break
+            print _("Press 'o' to show older activities")+"\r"
+            if getch() != 'o':
+                break
     
     def switch_activity(self):
         print _("Switch to new activity")
@@ -205,7 +916,6 @@ class TimelogUi:
             details = uraw_input(_("Details: "))
             date = ""
             ts = None
-            import time
             while date=="":
                 date = uraw_input(_("Enter a valid date in the format 'yyyy.mm.dd HH:MM': "))
                 try:
@@ -229,22 +939,203 @@ class TimelogUi:
         print "---------------------------------------\r"
         print "\r"
 
+    def show_year_report(self):
+        now = datetime.datetime.now()
+        report = self.tdb.year_report( now.year )
+        for (title, totals) in ( (_("Work per week"),  report.weeks),
+                                 (_("Work per month"), report.months) ):
+            print "\r"
+            print "---------------------------------------\r"
+            print "%s\r" % title
+            for period in sorted(totals):
+                work = sum( [microseconds for ((is_work, name), microseconds)
+                                          in totals[period].items()
+                                          if is_work] )
+                print "  %04u/%02u  %-3.2f\r" % (period[0], period[1],
+                                                 microseconds_to_hours(work))
+        print "---------------------------------------\r"
+        print "\r"
+
+class TimelogCli:
+    """Runs a single command given on the command line, without the
+    interactive menu, for scripts and batch use."""
+    def __init__(self, timelogdb, parser, options):
+        self.tdb = timelogdb
+        self.parser = parser
+        self.options = options
+
+    def run(self, command, args):
+        commands = {
+            "switch": self.switch,
+            "log":    self.show_log,
+            "report": self.report,
+            "export": self.export,
+            "import": self.import_log,
+            }
+        if not command in commands:
+            self.parser.error("unknown command '%s'" % command)
+        commands[command](args)
+
+    def find_activity(self, activity):
+        """Return the id of the activity with the given name or id."""
+        for (id, (name, is_work)) in sorted(self.tdb.catalogue.all().items()):
+            if activity in (name, str(id)):
+                return id
+        self.parser.error("unknown activity '%s'" % activity)
+
+    def parse_date(self, text, formats):
+        for format in formats:
+            try:
+                return datetime.datetime.strptime(text, format)
+            except ValueError:
+                pass
+        for (directive, field) in [("%Y", "yyyy"), ("%m", "mm"), ("%d", "dd"),
+                                   ("%H", "HH"), ("%M", "MM")]:
+            formats = [format.replace(directive, field) for format in formats]
+        self.parser.error("invalid date '%s', expected %s" % (
+            text, " or ".join(formats)))
+
+    def switch(self, args):
+        if not 1 <= len(args) <= 2:
+            self.parser.error("usage: switch ACTIVITY [DETAILS]")
+        activity_id = self.find_activity(args[0].decode("utf-8"))
+        details = u""
+        if len(args) == 2:
+            details = args[1].decode("utf-8")
+        ts = datetime.datetime.now()
+        if self.options.at:
+            ts = self.parse_date(self.options.at, ["%Y.%m.%d %H:%M"])
+        self.tdb.log_activity(activity_id, details, ts)
+
+    def show_log(self, args):
+        if args:
+            self.parser.error("usage: log [--count N]")
+        (entries, key) = self.tdb.log_page(None, self.options.count)
+        for (ts, name, details) in reversed(entries):
+            print (u" %s -   %-20s %s" % (ts.strftime("%Y.%m.%d %H:%M:%S"),
+                                         name, details)).encode("utf-8")
+
+    def report(self, args):
+        if len(args) > 1:
+            self.parser.error("usage: report [--month | --year] [DATE]")
+        if self.options.month and self.options.year:
+            self.parser.error("--month and --year are exclusive")
+        now = datetime.datetime.now()
+        if self.options.year:
+            year = now.year
+            if args:
+                year = self.parse_date(args[0], ["%Y"]).year
+            report = self.tdb.year_report(year)
+            for (title, totals) in ( (_("Work per week"),  report.weeks),
+                                     (_("Work per month"), report.months) ):
+                print title
+                for period in sorted(totals):
+                    work = sum( [microseconds
+                                 for ((is_work, name), microseconds)
+                                 in totals[period].items() if is_work] )
+                    print "  %04u/%02u  %-3.2f" % (
+                        period[0], period[1], microseconds_to_hours(work))
+            return
+        if self.options.month:
+            month = now
+            if args:
+                month = self.parse_date(args[0], ["%Y.%m"])
+            days = self.tdb.month_report(month.year, month.month)
+        else:
+            day = now
+            if args:
+                day = self.parse_date(args[0], ["%Y.%m.%d"])
+            days = [ (day.date(), self.tdb.day_report(day.date())) ]
+        for (d, r) in days:
+            print d.strftime("%Y.%m.%d")
+            for item in r:
+                if item[0]:
+                    print (u"  %-3.2f  %s - %s" % item[1:]).encode("utf-8")
+
+    def open_file(self, args, mode, std_stream):
+        """Return the file named in args, or std_stream if there is none or
+        it is '-', together with its format."""
+        if len(args) > 1:
+            self.parser.error("only one file can be given")
+        format = self.options.format
+        if not args or args[0] == "-":
+            return (std_stream, format or "csv")
+        if format is None:
+            format = "json"
+            if args[0].lower().endswith(".csv"):
+                format = "csv"
+        try:
+            return (open(args[0], mode), format)
+        except IOError, e:
+            self.parser.error("can't open the file: %s" % e)
+
+    def export(self, args):
+        (stream, format) = self.open_file(args, "wb", sys.stdout)
+        try:
+            self.tdb.export(stream, self.options.kind, format)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+    def import_log(self, args):
+        (stream, format) = self.open_file(args, "rb", sys.stdin)
+        try:
+            count = self.tdb.import_log(stream, format)
+        except (IOError, ImportRecordError), e:
+            self.parser.error("can't import the file: %s" % e)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        print _("Imported %u log entries") % count
+
 def main():
-    import gettext
     gettext.install('timetracker', 'locale', unicode=1)
     from optparse import OptionParser
-    parser = OptionParser(usage = "usage: %prog [options]")
+    parser = OptionParser(usage = "usage: %prog [options] [command [arguments]]\n"
+        "\n"
+        "Without a command the interactive menu is shown. Commands:\n"
+        "  switch ACTIVITY [DETAILS]  start an activity (given by name or id)\n"
+        "  log                        show the last logged activities\n"
+        "  report [DATE]              show the report of a day (yyyy.mm.dd),\n"
+        "                             month (--month, yyyy.mm) or year\n"
+        "                             (--year, yyyy), the current one by default\n"
+        "  export [FILE]              export the log (to stdout by default)\n"
+        "  import [FILE]              import log entries (from stdin by default)")
     parser.add_option("-d", "--debug", action="store_true", dest="debug", default=False,
                       help="Load a debug database instead of the production one")
+    parser.add_option("-p", "--profile", type="choice", choices=["fast", "safe"],
+                      dest="profile", default="fast",
+                      help="SQLite PRAGMA profile of the database connection [default: %default]")
+    parser.add_option("--at", dest="at", metavar="'yyyy.mm.dd HH:MM'",
+                      help="switch: start the activity at the given time instead of now")
+    parser.add_option("-n", "--count", type="int", dest="count", default=LOG_PAGE_SIZE,
+                      help="log: number of entries to show [default: %default]")
+    parser.add_option("-m", "--month", action="store_true", dest="month", default=False,
+                      help="report: show a monthly report")
+    parser.add_option("-y", "--year", action="store_true", dest="year", default=False,
+                      help="report: show a yearly report")
+    parser.add_option("-k", "--kind", type="choice", choices=["log", "days"],
+                      dest="kind", default="log",
+                      help="export: export the log entries (log) or the day reports (days) [default: %default]")
+    parser.add_option("-f", "--format", type="choice", choices=["csv", "json"],
+                      dest="format",
+                      help="export/import: file format, by default taken from the file name")
 
     (options, args) = parser.parse_args()
 
     database_file = "life_time_protocol.db"
     if options.debug:
         database_file = "time_protocol.db"
-    db = Timelog( database_file )
+    db = Timelog( database_file, options.profile )
     db.init()
-    db.open()
+    # The commands only reading the log don't need a writable database,
+    # unless the rollup has to be rebuilt first.
+    db.open(args[:1] in (["log"], ["report"], ["export"])
+            and not db.stale_totals)
+
+    if args:
+        TimelogCli(db, parser, options).run(args[0], args[1:])
+        return
 
     ui = TimelogUi(db)
 
@@ -257,6 +1148,10 @@ def main():
         ('n', ui.add_activity,      _("Add new activity")),
         (' ', None, None), 
         ('t', ui.show_month_report, _("Show monthly report")),
+        ('y', ui.show_year_report,  _("Show yearly report")),
+        ('r', ui.rebuild_daily_totals, _("Rebuild daily totals")),
+        ('i', ui.import_log,        _("Import activity log")),
+        ('e', ui.export_log,        _("Export activity log")),
         ]
     ).run()
 